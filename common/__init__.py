@@ -1,3 +1,8 @@
-from .utils import setup_logger, set_seed, load_yaml_config, save_yaml_config, save_json_results
-from .llm import BaseLLM, MockLLM, OllamaLLM
-from .data import generate_text_block, insert_needle
+from .utils import setup_logger, set_seed, spawn_rngs, load_yaml_config, save_yaml_config, save_json_results, config_hash, ResultsSink
+from .llm import BaseLLM, MockLLM, VirtualClock, OllamaLLM, EndpointPool, AdaptiveConcurrencyLimiter, OllamaClient, get_ollama_client, run_concurrently, split_numbered_answers, parse_json_response, ANSWER_SCHEMA, server_timing, accumulate_server_timing, SERVER_TIMING_KEYS
+from .data import DATA_VERSION, generate_text_block, generate_text_blocks, insert_needle, TextDocument
+from .cache import ResponseCache, CachedLLM, SemanticCache, SemanticCachedLLM, wrap_with_cache
+from .corpus import CorpusStore, DatasetCache, write_corpus
+from .results_store import RunIndex, record_run, RUN_INDEX_NAME
+from .mock_server import MockOllamaServer
+from .tokens import TokenCounter, count_tokens, get_token_counter
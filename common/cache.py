@@ -0,0 +1,393 @@
+"""On-disk response caching for LLM calls."""
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional, Union, Tuple
+
+from .llm import BaseLLM
+from .tokens import content_hash
+
+
+def signature_hash(signature: Dict[str, Any]) -> str:
+    """Content-address a request signature (model, prompt, options, seed)."""
+    canonical = json.dumps(signature, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed response store with size-bounded LRU eviction.
+
+    Entries are keyed by a content hash of the request signature. Every hit
+    refreshes the entry's access time; when the stored payload exceeds
+    ``max_bytes`` the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: Union[str, Path] = ".cache/llm_responses.sqlite", max_bytes: int = 512 * 1024 * 1024):
+        """
+        Args:
+            path: SQLite database file (created if missing)
+            max_bytes: Upper bound on the total size of cached payloads
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached result for ``key`` (refreshing its LRU position), or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Dict[str, Any]):
+        """Store a result and evict least recently used entries beyond max_bytes."""
+        payload = json.dumps(value, ensure_ascii=False, default=str)
+        size = len(payload.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, payload, size, time.time())
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for this process plus current store size."""
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": total
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+class CachedLLM(BaseLLM):
+    """
+    Wraps any BaseLLM with a ResponseCache.
+
+    Cached results keep the latency recorded when they were generated and
+    are marked with ``cached: True``. Use ``bypass=True`` (or the per-call
+    ``bypass_cache=True`` kwarg) for latency-measuring runs: lookups are
+    skipped but fresh responses are still written back.
+    """
+
+    def __init__(self, llm: BaseLLM, cache: ResponseCache, bypass: bool = False):
+        self.llm = llm
+        self.cache = cache
+        self.bypass = bypass
+        self.max_concurrency = llm.max_concurrency
+        self.limiter = llm.limiter
+
+    def __getattr__(self, name: str):
+        # Delegate backend-specific helpers (e.g. connection_stats) to the wrapped LLM
+        if name == 'llm':
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def request_signature(self, context: str, question: str, **kwargs) -> Dict[str, Any]:
+        return self.llm.request_signature(context, question, **kwargs)
+
+    def connection_stats(self) -> Dict[str, int]:
+        return self.llm.connection_stats()
+    
+    def warmup(self, *args, **kwargs) -> Dict[str, Any]:
+        return self.llm.warmup(*args, **kwargs)
+
+    def query(self, context: str, question: str, **kwargs) -> Dict[str, Any]:
+        bypass = kwargs.get('bypass_cache', False) or self.bypass
+        key = signature_hash(self.llm.request_signature(context, question, **_without_bypass(kwargs)))
+
+        if not bypass:
+            cached = self.cache.get(key)
+            if cached is not None:
+                # Accuracy depends on the caller's expected answer, not on the cached prompt
+                expected = kwargs.get('expected_answer', kwargs.get('needle_fact', ''))
+                if expected:
+                    cached['is_accurate'] = expected.lower() in cached['response'].lower()
+                cached['cached'] = True
+                return cached
+
+        result = self.llm.query(context, question, **_forwarded(self.llm, kwargs))
+        # Paraphrase hits belong to another question; don't pin them to this exact prompt
+        if not result.get('error') and not result.get('semantic_hit'):
+            self.cache.put(key, result)
+        result['cached'] = result.get('semantic_hit', False)
+        return result
+
+
+class SemanticCache:
+    """
+    In-memory cache matching paraphrased questions over the same context.
+
+    Entries are bucketed by a hash of the context (plus an optional
+    ``scope``: model, options, format... everything else that shapes the
+    answer), so only the question is compared semantically. Each bucket holds a FAISS inner-product index of
+    normalized question embeddings (i.e. cosine similarity). Once
+    ``capacity`` entries are stored, the least recently used are evicted.
+
+    sentence-transformers and faiss are imported on first use.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        capacity: int = 10000,
+        embedding_model: str = "all-MiniLM-L6-v2",
+        encoder: Optional[Any] = None
+    ):
+        """
+        Args:
+            threshold: Minimum cosine similarity for a question to count as a hit
+            capacity: Maximum number of cached answers
+            embedding_model: SentenceTransformer model used when no encoder is given
+            encoder: Pre-loaded encoder with an ``encode()`` method (e.g. shared with RAG code)
+        """
+        self.threshold = threshold
+        self.capacity = capacity
+        self.embedding_model = embedding_model
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._encoder = encoder
+        self._buckets: Dict[str, Any] = {}  # context hash -> faiss index over entry ids
+        self._entries: "OrderedDict[int, Tuple[str, Dict[str, Any]]]" = OrderedDict()  # id -> (context hash, result)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._encoder_lock = threading.Lock()
+
+    def _embed(self, question: str):
+        import numpy as np
+        if self._encoder is None:
+            # Parallel first lookups must not each load the model
+            with self._encoder_lock:
+                if self._encoder is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._encoder = SentenceTransformer(self.embedding_model)
+        vector = np.asarray(self._encoder.encode([question], convert_to_numpy=True), dtype="float32")
+        norm = np.linalg.norm(vector, axis=1, keepdims=True)
+        return vector / np.maximum(norm, 1e-12)
+
+    def _bucket(self, context_key: str, dim: int):
+        import faiss
+        if context_key not in self._buckets:
+            self._buckets[context_key] = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+        return self._buckets[context_key]
+
+    @staticmethod
+    def _context_key(context: str, scope: Optional[Dict[str, Any]]) -> str:
+        if scope is None:
+            return content_hash(context)
+        return signature_hash({"context": content_hash(context), "scope": scope})
+
+    def get(
+        self,
+        context: str,
+        question: str,
+        scope: Optional[Dict[str, Any]] = None
+    ) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Return (cached result, similarity) for the closest question above threshold, or None."""
+        context_key = self._context_key(context, scope)
+        vector = self._embed(question)
+        with self._lock:
+            index = self._buckets.get(context_key)
+            if index is not None and index.ntotal:
+                scores, ids = index.search(vector, 1)
+                if ids[0][0] != -1 and scores[0][0] >= self.threshold:
+                    entry_id = int(ids[0][0])
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return dict(self._entries[entry_id][1]), float(scores[0][0])
+            self.misses += 1
+        return None
+
+    def put(self, context: str, question: str, result: Dict[str, Any], scope: Optional[Dict[str, Any]] = None):
+        """Store a result for (context, question), evicting LRU entries beyond capacity."""
+        import numpy as np
+        context_key = self._context_key(context, scope)
+        vector = self._embed(question)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._bucket(context_key, vector.shape[1]).add_with_ids(vector, np.array([entry_id], dtype="int64"))
+            self._entries[entry_id] = (context_key, dict(result))
+            while len(self._entries) > self.capacity:
+                evicted_id, (evicted_context, _) = self._entries.popitem(last=False)
+                bucket = self._buckets[evicted_context]
+                bucket.remove_ids(np.array([evicted_id], dtype="int64"))
+                if not bucket.ntotal:
+                    del self._buckets[evicted_context]
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters, configuration and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "contexts": len(self._buckets),
+                "threshold": self.threshold,
+                "capacity": self.capacity
+            }
+
+
+class SemanticCachedLLM(BaseLLM):
+    """
+    Wraps any BaseLLM with a SemanticCache.
+
+    A hit returns the stored answer marked with ``semantic_hit: True`` and
+    the matched ``similarity``; accuracy is re-checked against the caller's
+    expected answer.
+    """
+
+    def __init__(self, llm: BaseLLM, semantic_cache: SemanticCache, bypass: bool = False):
+        self.llm = llm
+        self.semantic_cache = semantic_cache
+        self.bypass = bypass
+        self.max_concurrency = llm.max_concurrency
+        self.limiter = llm.limiter
+
+    def __getattr__(self, name: str):
+        if name == 'llm':
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def request_signature(self, context: str, question: str, **kwargs) -> Dict[str, Any]:
+        return self.llm.request_signature(context, question, **kwargs)
+
+    def connection_stats(self) -> Dict[str, int]:
+        return self.llm.connection_stats()
+
+    def warmup(self, *args, **kwargs) -> Dict[str, Any]:
+        return self.llm.warmup(*args, **kwargs)
+
+    def query(self, context: str, question: str, **kwargs) -> Dict[str, Any]:
+        # Only answers produced under the same model, options, format and stop
+        # settings are reused: the request signature without the question
+        scope = self.llm.request_signature(context, "", **_without_bypass(kwargs))
+        if not (kwargs.get('bypass_cache', False) or self.bypass):
+            match = self.semantic_cache.get(context, question, scope)
+            if match is not None:
+                cached, similarity = match
+                expected = kwargs.get('expected_answer', kwargs.get('needle_fact', ''))
+                if expected:
+                    cached['is_accurate'] = expected.lower() in cached['response'].lower()
+                cached['semantic_hit'] = True
+                cached['similarity'] = similarity
+                return cached
+
+        result = self.llm.query(context, question, **_forwarded(self.llm, kwargs))
+        if not result.get('error'):
+            self.semantic_cache.put(context, question, result, scope)
+        return result
+
+
+def _without_bypass(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in kwargs.items() if k != 'bypass_cache'}
+
+
+def _forwarded(llm: BaseLLM, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Query kwargs for the wrapped LLM: ``bypass_cache`` only reaches other cache layers."""
+    if isinstance(llm, (CachedLLM, SemanticCachedLLM)):
+        return kwargs
+    return _without_bypass(kwargs)
+
+
+def wrap_with_cache(
+    llm: BaseLLM,
+    cache_config: Optional[Dict[str, Any]] = None,
+    encoder: Optional[Any] = None
+) -> BaseLLM:
+    """
+    Apply a ``cache`` config section to an LLM.
+
+    Recognised keys: enabled, path, max_mb, bypass, plus a ``semantic``
+    subsection (enabled, threshold, capacity, embedding_model). Exact-match
+    lookups run before semantic ones. Returns ``llm`` unchanged when both
+    are disabled.
+
+    An already-loaded ``encoder`` (e.g. the experiment's RAG embedder) is
+    reused by the semantic cache; ``embedding_model`` must then be left
+    unset, since it would not be the model actually used.
+    """
+    if not cache_config:
+        return llm
+
+    semantic_config = cache_config.get('semantic') or {}
+    if semantic_config.get('enabled', False):
+        if encoder is not None and semantic_config.get('embedding_model'):
+            raise ValueError(
+                "cache.semantic.embedding_model is set but the semantic cache shares the "
+                "experiment's encoder; remove the key"
+            )
+        semantic_cache = SemanticCache(
+            threshold=semantic_config.get('threshold', 0.92),
+            capacity=semantic_config.get('capacity', 10000),
+            embedding_model=semantic_config.get('embedding_model', "all-MiniLM-L6-v2"),
+            encoder=encoder
+        )
+        llm = SemanticCachedLLM(llm, semantic_cache, bypass=cache_config.get('bypass', False))
+
+    if not cache_config.get('enabled', False):
+        return llm
+    cache = ResponseCache(
+        path=cache_config.get('path', ".cache/llm_responses.sqlite"),
+        max_bytes=int(cache_config.get('max_mb', 512) * 1024 * 1024)
+    )
+    return CachedLLM(llm, cache, bypass=cache_config.get('bypass', False))
@@ -0,0 +1,210 @@
+"""Disk-backed document corpora for large-scale experiments."""
+
+import os
+import json
+import mmap
+import struct
+import threading
+import dataclasses
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Union
+
+from .cache import signature_hash
+
+# Byte offsets are stored as native int64 (read back via memoryview.cast),
+# one per document plus the end of file
+_OFFSET = struct.Struct("q")
+
+
+def index_path(path: Union[str, Path]) -> Path:
+    """Offset index that accompanies a corpus JSONL file."""
+    path = Path(path)
+    return path.with_name(path.name + ".idx")
+
+
+def _to_record(document: Any) -> Dict[str, Any]:
+    if dataclasses.is_dataclass(document):
+        return dataclasses.asdict(document)
+    return dict(document)
+
+
+class CorpusStore:
+    """
+    Read-only, memory-mapped view of a corpus written by ``write_corpus``.
+
+    Documents live as JSONL records next to an int64 byte-offset index.
+    Both files are memory-mapped, so opening a store is O(1) in memory and
+    each document is decoded only when it is accessed. Iterating yields
+    documents one at a time and can be repeated (e.g. once per mode).
+    """
+
+    def __init__(self, path: Union[str, Path], record_type: Optional[Callable[..., Any]] = None):
+        """
+        Args:
+            path: Corpus JSONL file (its ``.idx`` index must exist)
+            record_type: Called with each record's fields to build the
+                         returned object (e.g. a dataclass); plain dicts if None
+        """
+        self.path = Path(path)
+        self.record_type = record_type
+
+        with open(index_path(self.path), 'rb') as f:
+            self._index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._offsets = memoryview(self._index).cast("q")
+        self._length = len(self._offsets) - 1
+
+        self._data: Optional[mmap.mmap] = None
+        if self._offsets[self._length] > 0:
+            with open(self.path, 'rb') as f:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, i: int) -> Any:
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError(f"document {i} out of range for corpus of {self._length}")
+        record = json.loads(self._data[self._offsets[i]:self._offsets[i + 1]])
+        return self.record_type(**record) if self.record_type is not None else record
+
+    def __iter__(self) -> Iterator[Any]:
+        for i in range(self._length):
+            yield self[i]
+
+    @property
+    def size_bytes(self) -> int:
+        """Size of the JSONL payload on disk."""
+        return self._offsets[self._length]
+
+    def close(self):
+        self._offsets.release()
+        self._index.close()
+        if self._data is not None:
+            self._data.close()
+
+    def __enter__(self) -> "CorpusStore":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_corpus(
+    documents: Iterable[Any],
+    path: Union[str, Path],
+    record_type: Optional[Callable[..., Any]] = None
+) -> CorpusStore:
+    """
+    Stream documents to a JSONL file plus offset index.
+
+    Documents are consumed one at a time, so a generator of any length can
+    be written with flat memory use. Both files are written under temporary
+    names and renamed into place when complete, so a crash never leaves a
+    corpus that looks valid.
+
+    Args:
+        documents: Iterable of dicts or dataclass instances
+        path: Destination JSONL file
+        record_type: Passed to the returned CorpusStore
+
+    Returns:
+        CorpusStore over the written corpus
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    idx_path = index_path(path)
+    # Unique per writer, so concurrent runs generating the same corpus don't collide
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    tmp_path = path.with_name(path.name + suffix)
+    tmp_idx_path = idx_path.with_name(idx_path.name + suffix)
+
+    offset = 0
+    with open(tmp_path, 'wb') as data, open(tmp_idx_path, 'wb') as index:
+        index.write(_OFFSET.pack(offset))
+        for document in documents:
+            line = (json.dumps(_to_record(document), ensure_ascii=False) + "\n").encode("utf-8")
+            data.write(line)
+            offset += len(line)
+            index.write(_OFFSET.pack(offset))
+
+    os.replace(tmp_path, path)
+    os.replace(tmp_idx_path, idx_path)
+    return CorpusStore(path, record_type=record_type)
+
+
+class DatasetCache:
+    """
+    Generated corpora on disk, keyed by everything that determines them.
+
+    The key hashes the generation config, the seed, the RNG stream index
+    (see ``spawn_rngs``) and a generator version, so repeated runs and
+    parameter sweeps that share a dataset skip generation entirely and
+    memory-map the stored corpus instead. Bump the generator version
+    whenever a change alters what a given seed produces.
+    """
+
+    def __init__(self, root: Union[str, Path] = ".cache/datasets"):
+        """
+        Args:
+            root: Directory holding cached corpora (created if missing)
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(config: Dict[str, Any], seed: int, version: Union[int, str], stream: int = 0) -> str:
+        """Content-address a dataset by its generation parameters."""
+        return signature_hash({"config": config, "seed": seed, "stream": stream, "version": version})
+
+    def path(self, key: str) -> Path:
+        return self.root / f"{key}.jsonl"
+
+    def get(self, key: str, record_type: Optional[Callable[..., Any]] = None) -> Optional[CorpusStore]:
+        """Open a cached corpus, or None if it has not been generated yet."""
+        path = self.path(key)
+        # The index is renamed into place last, so its presence means the corpus is complete
+        if not index_path(path).exists():
+            return None
+        return CorpusStore(path, record_type=record_type)
+
+    def get_or_create(
+        self,
+        config: Dict[str, Any],
+        seed: int,
+        version: Union[int, str],
+        generate: Callable[[], Iterable[Any]],
+        stream: int = 0,
+        record_type: Optional[Callable[..., Any]] = None
+    ) -> CorpusStore:
+        """
+        Load a cached corpus, generating and storing it on a miss.
+
+        Args:
+            config: Generation parameters (JSON-serializable)
+            seed: Experiment seed
+            version: Generator version
+            generate: Produces the documents (lazily) on a miss
+            stream: Index of the RNG stream the dataset is drawn from
+            record_type: Passed to the returned CorpusStore
+
+        Returns:
+            CorpusStore over the cached corpus
+        """
+        key = self.key(config, seed, version, stream)
+        store = self.get(key, record_type=record_type)
+        with self._lock:
+            if store is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if store is not None:
+            return store
+        return write_corpus(generate(), self.path(key), record_type=record_type)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "root": str(self.root)}
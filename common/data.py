@@ -1,7 +1,9 @@
 """Common data generation utilities."""
 
+import re
 import random
-from typing import List
+from array import array
+from typing import List, Dict, Tuple, Any, Optional, Union
 
 # Standard filler text for various domains
 TEMPLATES = {
@@ -35,32 +37,172 @@ TEMPLATES = {
     ]
 }
 
-def generate_text_block(domain: str = "generic", min_words: int = 100) -> str:
-    """Generate a coherent block of text of at least min_words."""
+# Bump when a change alters the text generated for a given seed (invalidates DatasetCache entries)
+DATA_VERSION = 1
+
+def generate_text_block(domain: str = "generic", min_words: int = 100, rng: Optional[random.Random] = None) -> str:
+    """Generate a coherent block of text of at least min_words (``rng`` defaults to the global random)."""
+    rng = rng or random
     templates = TEMPLATES.get(domain, TEMPLATES["generic"])
     words = []
     while len(words) < min_words:
-        sent = random.choice(templates)
+        sent = rng.choice(templates)
         words.extend(sent.split())
     
     return " ".join(words[:min_words])
 
-def insert_needle(text: str, needle: str, position: str | float = "random") -> str:
-    """Insert a needle (fact) into text at a rough position."""
-    words = text.split()
-    total = len(words)
+# domain -> (vocabulary, padded sentence matrix of vocabulary ids, min sentence length)
+_TOKENIZED: Dict[str, Tuple[Any, Any, int]] = {}
+
+def _tokenized_templates(domain: str) -> Tuple[Any, Any, int]:
+    """Tokenize a domain's TEMPLATES once into a vocabulary and a -1 padded id matrix."""
+    import numpy as np
+    if domain not in _TOKENIZED:
+        sentences = [sent.split() for sent in TEMPLATES.get(domain, TEMPLATES["generic"])]
+        vocab = sorted({word for words in sentences for word in words})
+        ids = {word: i for i, word in enumerate(vocab)}
+        matrix = np.full((len(sentences), max(len(words) for words in sentences)), -1, dtype=np.int32)
+        for row, words in enumerate(sentences):
+            matrix[row, :len(words)] = [ids[word] for word in words]
+        _TOKENIZED[domain] = (np.array(vocab, dtype=object), matrix, min(len(words) for words in sentences))
+    return _TOKENIZED[domain]
+
+def generate_text_blocks(
+    n_docs: int,
+    words_per_doc: int,
+    domain: str = "generic",
+    rng: Optional[Any] = None
+) -> List[str]:
+    """
+    Bulk version of generate_text_block: N documents of exactly M words.
+    
+    Samples every sentence choice in one draw, gathers the padded sentence
+    matrix, and drops padding with a cumulative-count mask, so the cost is a
+    handful of NumPy operations regardless of N.
+    
+    Args:
+        n_docs: Number of documents
+        words_per_doc: Words per document
+        domain: TEMPLATES domain
+        rng: numpy.random.Generator or random.Random (e.g. from spawn_rngs);
+             defaults to one seeded from ``random``, so set_seed() keeps
+             runs reproducible
+    
+    Returns:
+        List of n_docs text blocks
+    """
+    import numpy as np
+    if n_docs <= 0 or words_per_doc <= 0:
+        return [""] * max(n_docs, 0)
+    if rng is None or isinstance(rng, random.Random):
+        rng = np.random.default_rng((rng or random).getrandbits(64))
     
+    vocab, matrix, min_len = _tokenized_templates(domain)
+    # Enough sentences per document that even the shortest ones cover M words
+    n_sentences = -(-words_per_doc // min_len)
+    choices = rng.integers(0, matrix.shape[0], size=(n_docs, n_sentences))
+    
+    tokens = matrix[choices].reshape(n_docs, -1)
+    valid = tokens >= 0
+    keep = valid & (np.cumsum(valid, axis=1) <= words_per_doc)
+    words = vocab[tokens[keep].reshape(n_docs, words_per_doc)]
+    return [" ".join(row) for row in words]
+
+_WORD_RE = re.compile(r"\S+")
+
+def resolve_position(position: Union[str, float], total: int, rng: Optional[random.Random] = None) -> int:
+    """Map a needle position ("start"/"middle"/"end"/"random" or a fraction) to a word index."""
     if isinstance(position, float):
-        idx = int(total * position)
-        idx = max(0, min(idx, total)) # Clamp to bounds
-    elif position == "start":
-        idx = int(total * 0.1)
-    elif position == "end":
-        idx = int(total * 0.9)
-    elif position == "middle":
-        idx = int(total * 0.5)
-    else:
-        idx = random.randint(0, total)
+        return max(0, min(int(total * position), total))  # Clamp to bounds
+    if position == "start":
+        return int(total * 0.1)
+    if position == "end":
+        return int(total * 0.9)
+    if position == "middle":
+        return int(total * 0.5)
+    return (rng or random).randint(0, total)
+
+class TextDocument:
+    """
+    Text plus word-boundary offsets and needle insertions, rendered lazily.
+    
+    Word start offsets are kept in a compact array and shared between
+    derived documents, so ``with_needle()`` costs O(1) extra memory beyond
+    the needle itself. Position sweeps over one base text therefore tokenize
+    it once and copy it only when ``text`` is rendered.
+    """
+    
+    def __init__(self, text: str, _starts: Optional[array] = None, _needles: Tuple[Tuple[int, str], ...] = ()):
+        self.base = text
+        if _starts is None:
+            _starts = array('I' if len(text) < 2 ** 32 else 'Q', (m.start() for m in _WORD_RE.finditer(text)))
+        self._starts = _starts
+        self._needles = _needles  # (base word index, needle) in insertion order
+    
+    @property
+    def base_word_count(self) -> int:
+        return len(self._starts)
+    
+    @property
+    def word_count(self) -> int:
+        """Words in the rendered text, without re-splitting it."""
+        return len(self._starts) + sum(len(needle.split()) for _, needle in self._needles)
+    
+    @property
+    def needles(self) -> List[Tuple[int, str]]:
+        """(base word index, needle) pairs, ordered by position."""
+        return sorted(self._needles, key=lambda item: item[0])
+    
+    def with_needle(
+        self,
+        needle: str,
+        position: Union[str, float] = "random",
+        rng: Optional[random.Random] = None
+    ) -> "TextDocument":
+        """
+        Return a new document with ``needle`` inserted before a base word.
         
-    words.insert(idx, needle)
-    return " ".join(words)
+        Positions are resolved against the base text's words (see
+        resolve_position), independently of needles already inserted.
+        """
+        idx = resolve_position(position, len(self._starts), rng)
+        return TextDocument(self.base, self._starts, self._needles + ((idx, needle),))
+    
+    def _offset(self, idx: int) -> Tuple[int, str]:
+        """Character offset to insert at for base word ``idx``, and how to pad the needle."""
+        if idx < len(self._starts):
+            return self._starts[idx], "before"
+        return len(self.base.rstrip()), "after"
+    
+    @property
+    def text(self) -> str:
+        """Render the text with needles inserted; the base whitespace is preserved."""
+        if not self._needles:
+            return self.base
+        parts = []
+        cursor = 0
+        for idx, needle in self.needles:
+            offset, side = self._offset(idx)
+            parts.append(self.base[cursor:offset])
+            if side == "before":
+                parts.append(f"{needle} ")
+            else:
+                parts.append(f" {needle}" if offset else needle)
+            cursor = offset
+        parts.append(self.base[cursor:])
+        return "".join(parts)
+    
+    def __str__(self) -> str:
+        return self.text
+    
+    def __len__(self) -> int:
+        return self.word_count
+
+def insert_needle(
+    text: str,
+    needle: str,
+    position: str | float = "random",
+    rng: Optional[random.Random] = None
+) -> str:
+    """Insert a needle (fact) into text at a rough position (``rng`` drives "random")."""
+    return TextDocument(text).with_needle(needle, position, rng).text
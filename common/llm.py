@@ -1,14 +1,461 @@
 """Common LLM interfaces and Mock implementations."""
 
+import re
 import time
+import json
 import random
+import heapq
+import asyncio
+import threading
 import requests
+from collections import OrderedDict, deque
+from requests.adapters import HTTPAdapter
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+from typing import Dict, Any, Optional, List, Callable, Sequence, TypeVar, Iterator, Tuple, Union
+
+from .tokens import count_tokens, get_token_counter, content_hash
+
+T = TypeVar("T")
+
+
+async def _gather_bounded(calls: Sequence[Callable[[], T]], max_concurrency: int) -> List[T]:
+    """Run blocking callables on a dedicated thread pool, keeping at most
+    ``max_concurrency`` in flight. Results come back in submission order."""
+    limit = max(1, max_concurrency)
+    semaphore = asyncio.Semaphore(limit)
+    loop = asyncio.get_running_loop()
+
+    with ThreadPoolExecutor(max_workers=limit) as executor:
+        async def _run(call: Callable[[], T]) -> T:
+            async with semaphore:
+                return await loop.run_in_executor(executor, call)
+
+        return await asyncio.gather(*(_run(call) for call in calls))
+
+
+def run_concurrently(calls: Sequence[Callable[[], T]], max_concurrency: int = 1) -> List[T]:
+    """
+    Execute blocking callables concurrently with a bound on in-flight calls.
+    
+    Args:
+        calls: Zero-argument callables (e.g. functools.partial of a query)
+        max_concurrency: Maximum number of calls running at once
+        
+    Returns:
+        List of return values, in the same order as ``calls``
+    """
+    return asyncio.run(_gather_bounded(calls, max_concurrency))
+
+
+class OllamaClient:
+    """
+    Pooled, keep-alive HTTP client for a single Ollama server.
+    
+    One requests.Session is shared by every caller so TCP connections are
+    reused across queries instead of being set up per request.
+    """
+    
+    def __init__(
+        self,
+        base_url: str = "http://localhost:11434",
+        pool_connections: int = 4,
+        pool_maxsize: int = 10,
+        pool_block: bool = True
+    ):
+        """
+        Args:
+            base_url: Server root, e.g. http://localhost:11434
+            pool_connections: Number of per-host pools to keep
+            pool_maxsize: Max open connections per host
+            pool_block: Wait for a free connection instead of opening extra ones
+        """
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block
+        )
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+        self._lock = threading.Lock()
+        self._request_count = 0
+    
+    def post(self, path: str, payload: Dict[str, Any], timeout: float, stream: bool = False) -> requests.Response:
+        """POST a JSON payload to ``path`` on the pooled session."""
+        with self._lock:
+            self._request_count += 1
+        return self.session.post(f"{self.base_url}{path}", json=payload, timeout=timeout, stream=stream)
+    
+    def generate(self, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """Call /api/generate and return the decoded JSON body."""
+        response = self.post("/api/generate", payload, timeout)
+        response.raise_for_status()
+        return response.json()
+    
+    def generate_stream(
+        self,
+        payload: Dict[str, Any],
+        timeout: float,
+        on_response: Optional[Callable[[requests.Response], None]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Call /api/generate in streaming mode, yielding each NDJSON chunk as it arrives.
+        
+        ``on_response`` receives the open response (e.g. so another thread can close it).
+        """
+        response = self.post("/api/generate", {**payload, "stream": True}, timeout, stream=True)
+        if on_response is not None:
+            on_response(response)
+        with response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+    
+    def connection_stats(self) -> Dict[str, int]:
+        """Return request count and how many requests opened vs reused a connection."""
+        pools = self._adapter.poolmanager.pools
+        new_connections = sum(pools[key].num_connections for key in list(pools.keys()))
+        with self._lock:
+            request_count = self._request_count
+        return {
+            "requests": request_count,
+            "new_connections": new_connections,
+            "reused_connections": max(0, request_count - new_connections)
+        }
+    
+    def close(self):
+        self.session.close()
+
+
+_clients: Dict[str, OllamaClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_ollama_client(base_url: str = "http://localhost:11434", **pool_kwargs) -> OllamaClient:
+    """
+    Return the process-wide shared client for ``base_url``, creating it on first use.
+    
+    Pool settings only apply when the client is created; later callers share it.
+    """
+    key = base_url.rstrip("/")
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = OllamaClient(key, **pool_kwargs)
+        return _clients[key]
+
+
+class Endpoint:
+    """One Ollama server in an EndpointPool, with its load and health statistics."""
+    
+    def __init__(self, url: str, client: OllamaClient):
+        self.url = url
+        self.client = client
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.ewma_latency: Optional[float] = None
+        self.unhealthy_until = 0.0
+    
+    @property
+    def healthy(self) -> bool:
+        return time.time() >= self.unhealthy_until
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "ewma_latency": self.ewma_latency,
+            "healthy": self.healthy
+        }
+
+
+class EndpointPool:
+    """
+    Balances requests across several Ollama servers (e.g. one per NUMA node/port).
+    
+    Strategies:
+        least_outstanding: pick the healthy endpoint with fewest in-flight requests
+        p2c: power of two choices, sample two endpoints and take the less loaded
+    
+    The first request with a given affinity key (e.g. a hash of the prompt
+    prefix) is balanced normally; later ones stick to the same endpoint while
+    it stays healthy, keeping its KV cache warm. An endpoint is taken out of
+    rotation for ``retry_after`` seconds after ``max_consecutive_errors``
+    failures in a row.
+    """
+    
+    STRATEGIES = ("least_outstanding", "p2c")
+    
+    def __init__(
+        self,
+        urls: Sequence[str],
+        strategy: str = "least_outstanding",
+        pool_maxsize: int = 10,
+        max_consecutive_errors: int = 3,
+        retry_after: float = 30.0,
+        ewma_alpha: float = 0.2,
+        max_affinities: int = 4096
+    ):
+        if not urls:
+            raise ValueError("EndpointPool needs at least one URL")
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown balancing strategy '{strategy}', expected one of {self.STRATEGIES}")
+        self.strategy = strategy
+        self.max_consecutive_errors = max_consecutive_errors
+        self.retry_after = retry_after
+        self.ewma_alpha = ewma_alpha
+        self.endpoints = [Endpoint(url, get_ollama_client(url, pool_maxsize=pool_maxsize)) for url in urls]
+        self.max_affinities = max_affinities
+        self._affinity: "OrderedDict[str, Endpoint]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+    
+    def _candidates(self) -> List[Endpoint]:
+        healthy = [ep for ep in self.endpoints if ep.healthy]
+        # If everything is marked down, keep trying rather than failing outright
+        return healthy or self.endpoints
+    
+    def acquire(self, affinity_key: Optional[str] = None, exclude: Optional[Endpoint] = None) -> Endpoint:
+        """Choose an endpoint for a request and count it as outstanding.
+        
+        ``exclude`` steers the choice away from one endpoint when others exist
+        (used for hedged duplicates).
+        """
+        with self._lock:
+            endpoint = self._affinity.get(affinity_key) if affinity_key is not None else None
+            if endpoint is None or not endpoint.healthy:
+                candidates = [ep for ep in self._candidates() if ep is not exclude] or self._candidates()
+                if self.strategy == "p2c" and len(candidates) > 2:
+                    first, second = self._rng.sample(candidates, 2)
+                    endpoint = first if first.outstanding <= second.outstanding else second
+                else:
+                    endpoint = min(candidates, key=lambda ep: (ep.outstanding, ep.requests))
+            if affinity_key is not None:
+                self._affinity[affinity_key] = endpoint
+                self._affinity.move_to_end(affinity_key)
+                if len(self._affinity) > self.max_affinities:
+                    self._affinity.popitem(last=False)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+    
+    def release(self, endpoint: Endpoint, latency: float, error: bool = False, cancelled: bool = False):
+        """Record a finished request's latency and health signal."""
+        with self._lock:
+            endpoint.outstanding -= 1
+            if cancelled:
+                return
+            if error:
+                endpoint.errors += 1
+                endpoint.consecutive_errors += 1
+                if endpoint.consecutive_errors >= self.max_consecutive_errors:
+                    endpoint.unhealthy_until = time.time() + self.retry_after
+                return
+            endpoint.consecutive_errors = 0
+            endpoint.unhealthy_until = 0.0
+            if endpoint.ewma_latency is None:
+                endpoint.ewma_latency = latency
+            else:
+                endpoint.ewma_latency += self.ewma_alpha * (latency - endpoint.ewma_latency)
+    
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [ep.stats() for ep in self.endpoints]
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD (additive increase, multiplicative decrease) limit on in-flight LLM requests.
+    
+    Every request that completes quickly and without error grows the limit by
+    ``increase / limit`` (about +increase per round trip of the whole window);
+    an error or a latency above the threshold multiplies it by
+    ``decrease_factor``. The threshold is ``latency_target`` if given, else
+    ``latency_tolerance`` times the fastest latency observed. Only requests
+    started after the last decrease can trigger another one, so a burst of
+    slow responses from one overloaded window backs off once.
+    """
+    
+    def __init__(
+        self,
+        initial_limit: int = 1,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        increase: float = 1.0,
+        decrease_factor: float = 0.5,
+        latency_target: Optional[float] = None,
+        latency_tolerance: float = 2.0
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+        self.latency_tolerance = latency_tolerance
+        
+        self._limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._waiting = 0
+        self._epoch = 0
+        self._min_latency: Optional[float] = None
+        self.increases = 0
+        self.decreases = 0
+        self._cond = threading.Condition()
+    
+    @classmethod
+    def from_config(cls, limiter_config: Optional[Dict[str, Any]] = None) -> Optional["AdaptiveConcurrencyLimiter"]:
+        """Build a limiter from an ``adaptive_concurrency`` config section (None if disabled)."""
+        if not limiter_config or not limiter_config.get('enabled', False):
+            return None
+        return cls(**{k: v for k, v in limiter_config.items() if k != 'enabled'})
+    
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+    
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+    
+    @property
+    def queue_depth(self) -> int:
+        """Requests currently blocked waiting for a slot."""
+        return self._waiting
+    
+    def acquire(self) -> int:
+        """Block until a slot is free; returns a token to pass to release()."""
+        with self._cond:
+            self._waiting += 1
+            while self._in_flight >= int(self._limit):
+                self._cond.wait()
+            self._waiting -= 1
+            self._in_flight += 1
+            return self._epoch
+    
+    def release(self, token: int, latency: float, error: bool = False, cancelled: bool = False):
+        """
+        Free a slot and feed the request's outcome into the AIMD update.
+        
+        A ``cancelled`` request (e.g. a losing hedge) only frees its slot.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if cancelled:
+                self._cond.notify_all()
+                return
+            if not error:
+                self._min_latency = latency if self._min_latency is None else min(self._min_latency, latency)
+            
+            threshold = self.latency_target
+            if threshold is None and self._min_latency is not None:
+                threshold = self._min_latency * self.latency_tolerance
+            overloaded = error or (threshold is not None and latency > threshold)
+            
+            if overloaded:
+                if token == self._epoch:
+                    self._limit = max(self.min_limit, self._limit * self.decrease_factor)
+                    self._epoch += 1
+                    self.decreases += 1
+            elif self._limit < self.max_limit:
+                self._limit = min(self.max_limit, self._limit + self.increase / self._limit)
+                self.increases += 1
+            self._cond.notify_all()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "limit": int(self._limit),
+                "in_flight": self._in_flight,
+                "queue_depth": self._waiting,
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "min_latency": self._min_latency
+            }
+
+
+BATCH_INSTRUCTION = (
+    "Answer each of the following questions using the context. "
+    "Reply with one line per question, numbered to match, e.g. '1. <answer>'."
+)
+
+_NUMBERED_LINE_RE = re.compile(r"^\s*(?:Q(?:uestion)?\s*)?(\d+)\s*[.):\-]\s*(.*)$", re.IGNORECASE)
+
+
+def format_batch_question(questions: Sequence[str]) -> str:
+    """Pack several questions into one numbered question block."""
+    numbered = "\n".join(f"{i}. {question}" for i, question in enumerate(questions, 1))
+    return f"{BATCH_INSTRUCTION}\n{numbered}"
+
+
+def split_numbered_answers(response: str, count: int) -> List[str]:
+    """
+    Split a numbered multi-answer response back into per-question answers.
+    
+    Lines without a number continue the previous answer; numbers outside
+    1..count (and repeats) are ignored, and missing answers come back as ''.
+    """
+    answers: Dict[int, List[str]] = {}
+    current: Optional[int] = None
+    for line in response.splitlines():
+        match = _NUMBERED_LINE_RE.match(line)
+        if match:
+            number = int(match.group(1))
+            current = number if 1 <= number <= count and number not in answers else None
+            if current is not None:
+                answers[current] = [match.group(2).strip()]
+        elif current is not None and line.strip():
+            answers[current].append(line.strip())
+    return [" ".join(answers.get(i, [])) for i in range(1, count + 1)]
+
+
+_CODE_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def parse_json_response(text: str) -> Optional[Any]:
+    """
+    Parse a JSON-mode model response.
+    
+    Accepts bare JSON, JSON inside a Markdown code fence, or the first
+    ``{...}`` object embedded in surrounding prose. Returns None if nothing
+    parses.
+    """
+    text = _CODE_FENCE_RE.sub("", text.strip())
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        try:
+            return json.loads(text[start:end + 1])
+        except ValueError:
+            pass
+    return None
+
+
+# Structured output schema for single-answer queries (pass as format=ANSWER_SCHEMA)
+ANSWER_SCHEMA = {
+    "type": "object",
+    "properties": {"answer": {"type": "string"}},
+    "required": ["answer"]
+}
+
 
 class BaseLLM(ABC):
     """Abstract base class for LLMs."""
     
+    # Default number of in-flight requests for query_many()
+    max_concurrency: int = 1
+    # Optional adaptive limit applied to every request on top of max_concurrency
+    limiter: Optional[AdaptiveConcurrencyLimiter] = None
+    
     @abstractmethod
     def query(self, context: str, question: str, **kwargs) -> Dict[str, Any]:
         """
@@ -23,6 +470,169 @@ class BaseLLM(ABC):
             Dict containing 'response', 'latency', 'is_accurate' (if verifiable)
         """
         pass
+    
+    def request_signature(self, context: str, question: str, **kwargs) -> Dict[str, Any]:
+        """
+        Describe everything that determines the response to a query.
+        
+        Used as the cache key by response caches; implementations should
+        include the model, the final prompt and the sampling options.
+        """
+        return {
+            "llm": type(self).__name__,
+            "context": context,
+            "question": question,
+            "kwargs": {k: str(v) for k, v in sorted(kwargs.items())}
+        }
+    
+    def connection_stats(self) -> Dict[str, int]:
+        """HTTP connection reuse counters (backends without a network report zeros)."""
+        return {"requests": 0, "new_connections": 0, "reused_connections": 0}
+    
+    def warmup(self) -> Dict[str, Any]:
+        """Load the model before measuring (backends without a cold start do nothing)."""
+        return {}
+    
+    def query_batch(
+        self,
+        context: str,
+        questions: Sequence[str],
+        expected_answers: Optional[Sequence[str]] = None,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        Ask several questions about one context in a single call.
+        
+        The context is prefilled once for all questions; the numbered answers
+        are split back out and scored individually. The backend's output
+        token limit must leave room for every answer.
+        
+        Args:
+            context: Shared input context
+            questions: Questions to ask
+            expected_answers: Optional ground truth, one per question
+            **kwargs: Passed through to query()
+            
+        Returns:
+            The query() result (latency, token_count, ...) plus 'answers'
+            (per-question response and is_accurate), 'accuracy' (fraction of
+            questions answered correctly) and 'is_accurate' (all correct)
+        """
+        expected_answers = list(expected_answers) if expected_answers is not None else [''] * len(questions)
+        if len(expected_answers) != len(questions):
+            raise ValueError("expected_answers must have one entry per question")
+        
+        result = self.query(
+            context=context,
+            question=format_batch_question(questions),
+            expected_answers=expected_answers,
+            **kwargs
+        )
+        
+        answers = []
+        for question, expected, response in zip(
+            questions, expected_answers, split_numbered_answers(result['response'], len(questions))
+        ):
+            answers.append({
+                "question": question,
+                "expected_answer": expected,
+                "response": response,
+                "is_accurate": bool(expected) and expected.lower() in response.lower()
+            })
+        
+        result['answers'] = answers
+        result['accuracy'] = sum(a['is_accurate'] for a in answers) / len(answers) if answers else 0.0
+        result['is_accurate'] = bool(answers) and all(a['is_accurate'] for a in answers)
+        return result
+    
+    async def aquery(self, context: str, question: str, **kwargs) -> Dict[str, Any]:
+        """Async variant of query(); runs the blocking call on a worker thread."""
+        return await asyncio.to_thread(self.query, context, question, **kwargs)
+    
+    async def aquery_many(
+        self,
+        items: Sequence[Dict[str, Any]],
+        max_concurrency: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Async variant of query_many() for callers already inside an event loop."""
+        limit = max_concurrency if max_concurrency is not None else self.max_concurrency
+        calls = [partial(self.query, **item) for item in items]
+        return await _gather_bounded(calls, limit)
+    
+    def query_many(
+        self,
+        items: Sequence[Dict[str, Any]],
+        max_concurrency: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Issue several queries concurrently.
+        
+        Args:
+            items: One dict of query() keyword arguments per request
+                   (must include 'context' and 'question')
+            max_concurrency: In-flight request limit (defaults to self.max_concurrency)
+            
+        Returns:
+            Query results in submission order; each keeps its own 'latency'
+        """
+        return asyncio.run(self.aquery_many(items, max_concurrency))
+
+class VirtualClock:
+    """
+    Simulated time source for MockLLM.
+    
+    Instead of sleeping, simulated latency is accumulated here. The clock
+    models ``num_servers`` identical inference servers fed from one FIFO
+    queue, so concurrent submissions see realistic queueing delay.
+    """
+    
+    def __init__(self, num_servers: int = 1):
+        self.num_servers = max(1, num_servers)
+        self.now = 0.0
+        self.requests = 0
+        self.busy_time = 0.0
+        self.total_queue_wait = 0.0
+        self._free_at = [0.0] * self.num_servers  # min-heap of server free times
+        self._lock = threading.Lock()
+    
+    def submit(self, service_time: float, arrival: Optional[float] = None) -> Tuple[float, float]:
+        """
+        Schedule a request on the earliest free server.
+        
+        Args:
+            service_time: Simulated processing time in seconds
+            arrival: Virtual arrival time (defaults to the current time)
+            
+        Returns:
+            (start, finish) virtual timestamps
+        """
+        with self._lock:
+            arrival = self.now if arrival is None else arrival
+            start = max(arrival, heapq.heappop(self._free_at))
+            finish = start + service_time
+            heapq.heappush(self._free_at, finish)
+            self.requests += 1
+            self.busy_time += service_time
+            self.total_queue_wait += start - arrival
+        return start, finish
+    
+    def advance_to(self, timestamp: float):
+        """Move the clock forward (never backwards)."""
+        with self._lock:
+            self.now = max(self.now, timestamp)
+    
+    def sleep(self, seconds: float):
+        self.advance_to(self.now + seconds)
+    
+    def stats(self) -> Dict[str, float]:
+        elapsed = self.now
+        return {
+            "simulated_time": elapsed,
+            "requests": self.requests,
+            "avg_queue_wait": self.total_queue_wait / self.requests if self.requests else 0.0,
+            "utilization": self.busy_time / (self.num_servers * elapsed) if elapsed > 0 else 0.0
+        }
+
 
 class MockLLM(BaseLLM):
     """
@@ -30,6 +640,9 @@ class MockLLM(BaseLLM):
     Can simulate:
     1. Latency based on context length.
     2. Accuracy degradation based on noise/length ("Lost in the Middle").
+    
+    With a VirtualClock, latency is charged to the clock instead of slept,
+    so large simulated sweeps complete in milliseconds.
     """
     
     def __init__(
@@ -38,20 +651,34 @@ class MockLLM(BaseLLM):
         latency_per_token: float = 0.0005,
         noise_threshold: int = 5000,
         noise_prob_low: float = 0.0,
-        noise_prob_high: float = 0.5
+        noise_prob_high: float = 0.5,
+        clock: Optional[VirtualClock] = None
     ):
         self.latency_base = latency_base
         self.latency_per_token = latency_per_token
         self.noise_threshold = noise_threshold
         self.noise_prob_low = noise_prob_low
         self.noise_prob_high = noise_prob_high
-
-    def query(self, context: str, question: str, **kwargs) -> Dict[str, Any]:
-        start_time = time.time()
+        self.clock = clock
+    
+    @classmethod
+    def from_config(cls, mock_config: Optional[Dict[str, Any]] = None) -> "MockLLM":
+        """
+        Build a MockLLM from a config section.
         
-        # Estimate tokens (approx 1.3 chars per token or just split words)
-        # Using simple word count for consistency across experiments
-        token_count = len(context.split())
+        Recognised keys: the constructor's latency/noise parameters plus
+        virtual_clock (bool, default True) and num_servers.
+        """
+        mock_config = dict(mock_config or {})
+        use_clock = mock_config.pop('virtual_clock', True)
+        num_servers = mock_config.pop('num_servers', 1)
+        clock = VirtualClock(num_servers=num_servers) if use_clock else None
+        return cls(clock=clock, **mock_config)
+
+    def simulate(self, context: str, question: str, **kwargs) -> Dict[str, Any]:
+        """Compute a simulated result (response, latency, accuracy) without sleeping."""
+        # Estimate tokens with the shared (memoized) counter
+        token_count = count_tokens(context)
         
         # Simulate Latency
         process_time = self.latency_base + (token_count * self.latency_per_token)
@@ -67,6 +694,23 @@ class MockLLM(BaseLLM):
             
         is_accurate = random.random() > failure_prob
         
+        # Batched questions (query_batch): one numbered answer line each
+        batch_expected = kwargs.get('expected_answers')
+        if batch_expected:
+            lines = []
+            for i, expected in enumerate(batch_expected, 1):
+                answered = expected and random.random() > failure_prob
+                lines.append(f"{i}. {expected if answered else 'Unknown'}")
+            response = "\n".join(lines)
+            # Decoding one answer per question on top of a single prefill
+            process_time += self.latency_per_token * 10 * (len(batch_expected) - 1)
+            return {
+                "response": response,
+                "latency": process_time,
+                "token_count": token_count,
+                "is_accurate": is_accurate
+            }
+        
         # Check expected answer if provided
         needle = kwargs.get('expected_answer', '')
         if needle and is_accurate:
@@ -76,17 +720,9 @@ class MockLLM(BaseLLM):
         else:
             # Fallback for generic queries
             response = "Simulated Response"
-
-        # Sleep (Simulate API call)
-        # Cap sleep for dev speed, but report full calculated latency?
-        # Let's sleep a fraction of it to keep tests fast, unless 'real_time' flag is passed.
-        # For this environment, we'll just sleep the full amount up to a limit.
-        time.sleep(min(process_time, 1.0)) 
-        
-        # Record actual elapsed or simulated? 
-        # Usually for experiments we want the simulated latency metric if we are mocking hardware.
-        # But let's return the calculated process_time as 'latency' to match the physics we defined.
         
+        # Usually for experiments we want the simulated latency metric if we are mocking hardware,
+        # so the calculated process_time is reported as 'latency' to match the physics we defined.
         return {
             "response": response,
             "latency": process_time,
@@ -94,6 +730,145 @@ class MockLLM(BaseLLM):
             "is_accurate": is_accurate
         }
 
+    def _charge_clock(self, result: Dict[str, Any], arrival: float) -> float:
+        """Queue a simulated result on the virtual clock; latency includes queueing."""
+        start, finish = self.clock.submit(result['latency'], arrival=arrival)
+        result['queue_wait'] = start - arrival
+        result['service_time'] = result['latency']
+        result['latency'] = finish - arrival
+        return finish
+    
+    def query(self, context: str, question: str, **kwargs) -> Dict[str, Any]:
+        result = self.simulate(context, question, **kwargs)
+        
+        if self.clock is not None:
+            self.clock.advance_to(self._charge_clock(result, self.clock.now))
+            return result
+
+        # Sleep (Simulate API call)
+        # Cap sleep for dev speed, but report full calculated latency.
+        time.sleep(min(result['latency'], 1.0)) 
+        
+        return result
+    
+    def query_many(
+        self,
+        items: Sequence[Dict[str, Any]],
+        max_concurrency: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        if self.clock is None:
+            return super().query_many(items, max_concurrency)
+        
+        # Simulated concurrency: every request is issued at the current virtual
+        # time, and a new one starts as soon as one of the client's slots frees.
+        limit = max(1, max_concurrency if max_concurrency is not None else self.max_concurrency)
+        slots = [self.clock.now] * limit
+        results = []
+        for item in items:
+            issued = heapq.heappop(slots)
+            result = self.simulate(**item)
+            heapq.heappush(slots, self._charge_clock(result, issued))
+            results.append(result)
+        
+        self.clock.advance_to(max(slots))
+        return results
+    
+    async def aquery_many(
+        self,
+        items: Sequence[Dict[str, Any]],
+        max_concurrency: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        if self.clock is None:
+            return await super().aquery_many(items, max_concurrency)
+        return self.query_many(items, max_concurrency)
+
+
+DEFAULT_PROMPT_TEMPLATE = "Context: {context}\n\nQuestion: {question}\n\nAnswer briefly:"
+
+# A first prefill that evaluates less than this share of the approximate
+# prompt length hit a prefix the server had already cached
+_COLD_PREFILL_FRACTION = 0.5
+
+# Ollama reports these in nanoseconds; results carry them in seconds
+_DURATION_FIELDS = ("load_duration", "prompt_eval_duration", "eval_duration", "total_duration")
+
+# Per-request server timing keys added to OllamaLLM results
+SERVER_TIMING_KEYS = _DURATION_FIELDS + ("prompt_eval_count", "eval_count", "client_overhead")
+
+
+def server_timing(body: Dict[str, Any], latency: float) -> Dict[str, float]:
+    """
+    Break a request's latency down using Ollama's timing fields.
+    
+    Args:
+        body: Final /api/generate response (or last stream chunk)
+        latency: Client-observed end-to-end latency in seconds
+    
+    Returns:
+        Durations in seconds plus token counts and ``client_overhead``
+        (latency not spent inside the server: network, queueing, parsing).
+        Empty if the server reported no timing.
+    """
+    if 'total_duration' not in body:
+        return {}
+    timing: Dict[str, float] = {field: body.get(field, 0) / 1e9 for field in _DURATION_FIELDS}
+    timing["prompt_eval_count"] = body.get('prompt_eval_count', 0)
+    timing["eval_count"] = body.get('eval_count', 0)
+    timing["client_overhead"] = max(0.0, latency - timing["total_duration"])
+    return timing
+
+
+def accumulate_server_timing(totals: Dict[str, float], result: Dict[str, Any]) -> Dict[str, float]:
+    """Add a result's server timing fields (if any) into running ``totals``."""
+    for key in SERVER_TIMING_KEYS:
+        if key in result:
+            totals[key] = totals.get(key, 0) + result[key]
+    return totals
+
+
+def _truncate_at_stop(text: str, stop: Sequence[str]) -> str:
+    """Cut ``text`` at the earliest (case-insensitive) stop sequence."""
+    lowered = text.lower()
+    cut = min((lowered.find(s.lower()) for s in stop if s.lower() in lowered), default=len(text))
+    return text[:cut].strip()
+
+
+class HedgeCancelled(Exception):
+    """Raised inside the losing half of a hedged request once it is cancelled."""
+
+
+class _Cancellation:
+    """
+    Cancel flag for one half of a hedged request.
+    
+    Setting it also closes the request's HTTP response (once the server has
+    answered), so the loser's connection drops immediately and Ollama stops
+    working on it instead of at the next streamed chunk.
+    """
+    
+    def __init__(self):
+        self._event = threading.Event()
+        self._response: Optional[requests.Response] = None
+        self._lock = threading.Lock()
+    
+    def is_set(self) -> bool:
+        return self._event.is_set()
+    
+    def set(self):
+        with self._lock:
+            self._event.set()
+            response = self._response
+        if response is not None:
+            response.close()
+    
+    def attach(self, response: requests.Response):
+        """Register the in-flight response; closes it at once if already cancelled."""
+        with self._lock:
+            self._response = response
+            cancelled = self._event.is_set()
+        if cancelled:
+            response.close()
+
 
 class OllamaLLM(BaseLLM):
     """
@@ -103,66 +878,543 @@ class OllamaLLM(BaseLLM):
     def __init__(
         self,
         model_name: str = "llama3.2:1b",
-        base_url: str = "http://localhost:11434",
+        base_url: Union[str, Sequence[str]] = "http://localhost:11434",
         temperature: float = 0.0,
         max_tokens: int = 100,
-        timeout: int = 120
+        timeout: int = 120,
+        max_concurrency: int = 1,
+        pool_maxsize: int = 10,
+        stream: bool = False,
+        seed: Optional[int] = None,
+        prompt_template: str = DEFAULT_PROMPT_TEMPLATE,
+        keep_alive: Optional[str] = None,
+        limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+        balancing: str = "least_outstanding",
+        sticky_prefix: bool = True,
+        hedge_percentile: Optional[float] = None,
+        hedge_min_samples: int = 20,
+        format: Optional[Union[str, Dict[str, Any]]] = None,
+        early_stop: bool = False,
+        stop: Optional[Sequence[str]] = None
     ):
+        urls = [base_url] if isinstance(base_url, str) else list(base_url)
         self.model_name = model_name
-        self.base_url = base_url
+        self.base_url = urls[0]
         self.temperature = temperature
         self.max_tokens = max_tokens
         self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        # With an adaptive limiter, callers may fan out up to its ceiling and
+        # the limiter decides how many requests are actually in flight
+        self.limiter = limiter
+        if limiter is not None:
+            self.max_concurrency = max(max_concurrency, limiter.max_limit)
+        # Stream tokens to measure time-to-first-token and decode rate
+        self.stream = stream
+        # Fixed sampling seed (None lets the server pick one)
+        self.seed = seed
+        # Must contain {context} and {question} placeholders
+        self.prompt_template = prompt_template
+        self.token_counter = get_token_counter()
+        # How long Ollama keeps the model (and its KV cache) loaded, e.g. "30m"
+        self.keep_alive = keep_alive
+        # Default structured output mode: "json" or a JSON schema (per-call format= overrides)
+        self.format = format
+        # Abort decoding once the expected answer has streamed in
+        self.early_stop = early_stop
+        # Stop sequences, enforced by the server (options.stop) and, with early stop, by the stream reader
+        self.stop = list(stop) if stop else None
+        # Context prefix -> prompt tokens the server evaluated on the cold request
+        # (the baseline that later requests sharing the prefix save against)
+        self._prefix_tokens: Dict[str, int] = {}
+        self._prefix_lock = threading.Lock()
+        self.prefill_tokens_saved = 0
+        # One shared keep-alive pool per server, sized so every in-flight request
+        # (and, when hedging, its duplicate) gets a connection; several URLs are load balanced
+        in_flight = self.max_concurrency * (2 if hedge_percentile is not None else 1)
+        self.endpoints = EndpointPool(urls, strategy=balancing, pool_maxsize=max(pool_maxsize, in_flight))
+        self.client = self.endpoints.endpoints[0].client
+        # Route prompts sharing a context prefix to the same server (warm KV cache)
+        self.sticky_prefix = sticky_prefix and len(urls) > 1
+        # Hedging: once a request outlives this percentile of recent latencies,
+        # send a duplicate to another endpoint/slot and keep the first answer
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedges_issued = 0
+        self.hedges_won = 0
+        self._latencies: deque = deque(maxlen=256)
+        self._hedge_lock = threading.Lock()
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        if hedge_percentile is not None:
+            self._hedge_executor = ThreadPoolExecutor(max_workers=2 * self.max_concurrency + 2)
+    
+    def hedge_stats(self) -> Dict[str, Any]:
+        """Counts of hedged duplicates sent and how many of them answered first."""
+        with self._hedge_lock:
+            return {
+                "hedges_issued": self.hedges_issued,
+                "hedges_won": self.hedges_won,
+                "hedge_delay": self._hedge_delay()
+            }
+    
+    def connection_stats(self) -> Dict[str, int]:
+        """Connection reuse counters of the underlying shared HTTP pools."""
+        totals = {"requests": 0, "new_connections": 0, "reused_connections": 0}
+        for endpoint in self.endpoints.endpoints:
+            for key, value in endpoint.client.connection_stats().items():
+                totals[key] += value
+        return totals
+    
+    def endpoint_stats(self) -> List[Dict[str, Any]]:
+        """Per-endpoint load, latency and health."""
+        return self.endpoints.stats()
+    
+    def warmup(self, prompt: str = "Reply with OK.") -> Dict[str, Any]:
+        """
+        Pre-flight every endpoint so measurements start from a loaded model.
+        
+        Sends an empty prompt (which makes Ollama load the model and pin it
+        for ``keep_alive``) followed by a throwaway generation, bypassing the
+        balancer, limiter and hedging statistics.
+        
+        Args:
+            prompt: Throwaway prompt used to exercise the full generate path
+        
+        Returns:
+            Dict with 'load_time' (slowest endpoint's model load, seconds)
+            and per-endpoint load/warm-up timings
+        """
+        load_payload: Dict[str, Any] = {"model": self.model_name, "prompt": "", "stream": False}
+        warm_payload: Dict[str, Any] = {
+            "model": self.model_name,
+            "prompt": prompt,
+            "stream": False,
+            "options": {"temperature": self.temperature, "num_predict": 1}
+        }
+        if self.keep_alive is not None:
+            load_payload["keep_alive"] = self.keep_alive
+            warm_payload["keep_alive"] = self.keep_alive
+        
+        endpoints = []
+        for endpoint in self.endpoints.endpoints:
+            start = time.time()
+            loaded = endpoint.client.generate(load_payload, timeout=self.timeout)
+            load_wall = time.time() - start
+            
+            start = time.time()
+            endpoint.client.generate(warm_payload, timeout=self.timeout)
+            endpoints.append({
+                "url": endpoint.url,
+                # Server-side load time excludes queueing/network; fall back to wall time
+                "load_time": loaded.get('load_duration', load_wall * 1e9) / 1e9,
+                "load_wall_time": load_wall,
+                "warmup_latency": time.time() - start
+            })
+        
+        return {
+            "load_time": max(e["load_time"] for e in endpoints),
+            "keep_alive": self.keep_alive,
+            "endpoints": endpoints
+        }
+    
+    def unload(self):
+        """Ask every endpoint to evict the model now (keep_alive=0)."""
+        for endpoint in self.endpoints.endpoints:
+            endpoint.client.generate({"model": self.model_name, "prompt": "", "keep_alive": 0, "stream": False},
+                                     timeout=self.timeout)
+    
+    def _generate_streaming(
+        self,
+        payload: Dict[str, Any],
+        start_time: float,
+        client: OllamaClient,
+        cancel: Optional[_Cancellation] = None,
+        stop_when: Optional[Callable[[str], bool]] = None
+    ) -> Dict[str, Any]:
+        """Consume the NDJSON stream incrementally and derive prefill/decode timings.
+        
+        Setting ``cancel`` closes the response (and its connection), which
+        makes Ollama stop generating, and raises HedgeCancelled here.
+        ``stop_when`` is checked against the text received so far and ends
+        the stream the same way.
+        """
+        pieces: List[str] = []
+        token_times: List[float] = []
+        final: Dict[str, Any] = {}
+        text = ""
+        stopped_early = False
+        
+        chunks = client.generate_stream(payload, timeout=self.timeout,
+                                        on_response=cancel.attach if cancel is not None else None)
+        try:
+            for chunk in chunks:
+                if cancel is not None and cancel.is_set():
+                    raise HedgeCancelled()
+                if chunk.get('response'):
+                    token_times.append(time.time())
+                    pieces.append(chunk['response'])
+                    if stop_when is not None:
+                        text += chunk['response']
+                        if stop_when(text):
+                            stopped_early = True
+                            break
+                if chunk.get('done'):
+                    final = chunk
+        except Exception:
+            # Closing the response from the winning thread surfaces here as a read error
+            if cancel is not None and cancel.is_set():
+                raise HedgeCancelled()
+            raise
+        finally:
+            chunks.close()
+        if cancel is not None and cancel.is_set():
+            raise HedgeCancelled()
+        
+        end_time = time.time()
+        output_tokens = final.get('eval_count', len(token_times))
+        
+        # Time to first token ~ queueing + model load + prefill
+        ttft = (token_times[0] - start_time) if token_times else end_time - start_time
+        gaps = [b - a for a, b in zip(token_times, token_times[1:])]
+        inter_token_latency = sum(gaps) / len(gaps) if gaps else 0.0
+        
+        # Prefer the server's own decode timing, fall back to client-side arrival times
+        if final.get('eval_duration'):
+            tokens_per_second = output_tokens / (final['eval_duration'] / 1e9)
+        elif len(token_times) > 1:
+            tokens_per_second = (len(token_times) - 1) / (token_times[-1] - token_times[0])
+        else:
+            tokens_per_second = 0.0
+        
+        return {
+            **final,
+            "response": "".join(pieces),
+            "stopped_early": stopped_early,
+            "ttft": ttft,
+            "inter_token_latency": inter_token_latency,
+            "tokens_per_second": tokens_per_second,
+            "output_tokens": output_tokens
+        }
+    
+    def _build_payload(
+        self,
+        context: str,
+        question: str,
+        format: Optional[Union[str, Dict[str, Any]]] = None
+    ) -> Dict[str, Any]:
+        """Build the /api/generate request body for a query."""
+        options = {
+            "temperature": self.temperature,
+            "num_predict": self.max_tokens
+        }
+        if self.seed is not None:
+            options["seed"] = self.seed
+        if self.stop:
+            options["stop"] = self.stop
+        
+        payload = {
+            "model": self.model_name,
+            "prompt": self.prompt_template.format(context=context, question=question),
+            "stream": False,
+            "options": options
+        }
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        format = format if format is not None else self.format
+        if format is not None:
+            payload["format"] = format
+        return payload
+    
+    def _prompt_prefix(self, context: str) -> str:
+        """The part of the prompt before the question; identical across questions on one context."""
+        return self.prompt_template.partition("{question}")[0].format(context=context)
+    
+    def _account_prefill(self, prefix_key: str, prompt: str, result: Dict[str, Any]) -> Tuple[int, bool]:
+        """
+        Record the prompt's token count and measure prefill tokens skipped
+        thanks to Ollama reusing the KV cache of a shared prompt prefix.
+        
+        Ollama only reports the tokens it actually evaluated in
+        ``prompt_eval_count`` (and omits it when the whole prompt was cached).
+        Savings compare that against the server's own count for the first
+        cold request on the same prefix, so both sides come from the real
+        tokenizer rather than the offline approximation.
+        
+        The first request this process sends for a prefix may still hit a
+        warm server (``keep_alive`` outlives the process). A count well below
+        the approximation is taken as such: it is neither recorded as the
+        prompt's exact count nor used as the baseline.
+        
+        Returns:
+            (prefill tokens saved, whether the sample was warm with no baseline)
+        """
+        if not result.get('done'):
+            # Stream aborted early: the final stats chunk never arrived
+            return 0, False
+        
+        evaluated = result.get('prompt_eval_count', 0)
+        with self._prefix_lock:
+            baseline = self._prefix_tokens.get(prefix_key)
+            if baseline is None:
+                if evaluated < _COLD_PREFILL_FRACTION * self.token_counter.count(prompt):
+                    # Prefix already cached on the server: no trustworthy baseline
+                    return 0, True
+                # Cold prefix: the server evaluated the full prompt
+                self._prefix_tokens[prefix_key] = evaluated
+                self.token_counter.record(prompt, evaluated)
+                return 0, False
+            saved = max(0, baseline - evaluated)
+            self.prefill_tokens_saved += saved
+        return saved, False
+    
+    def request_signature(self, context: str, question: str, **kwargs) -> Dict[str, Any]:
+        payload = self._build_payload(context, question, kwargs.get('format'))
+        signature = {
+            "model": payload["model"],
+            "prompt": payload["prompt"],
+            "options": payload["options"],
+            "seed": self.seed
+        }
+        if "format" in payload:
+            signature["format"] = payload["format"]
+        stop_on = self._stop_on(kwargs)
+        if stop_on:
+            # Early-stopped responses are truncated at the expected answer
+            signature["stop_on"] = stop_on
+        return signature
+    
+    def _stop_on(self, kwargs: Dict[str, Any]) -> Optional[str]:
+        """Expected answer that ends generation early (None if early stop is off)."""
+        if not self.early_stop:
+            return None
+        return kwargs.get('expected_answer', kwargs.get('needle_fact', '')) or None
+    
+    def _stop_condition(self, stop_on: Optional[str]) -> Optional[Callable[[str], bool]]:
+        """Build the stream stop check from the expected answer and stop sequences (early stop only)."""
+        # Without early stop the server enforces the stop sequences on its own,
+        # so there is nothing to check client-side and no reason to stream
+        if not self.early_stop:
+            return None
+        needles = [stop_on.lower()] if stop_on else []
+        if self.stop:
+            needles.extend(s.lower() for s in self.stop)
+        if not needles:
+            return None
+        return lambda text: any(needle in text.lower() for needle in needles)
+    
+    def _send_to(
+        self,
+        endpoint: Endpoint,
+        payload: Dict[str, Any],
+        start_time: float,
+        cancel: Optional[_Cancellation] = None,
+        stop_when: Optional[Callable[[str], bool]] = None
+    ) -> Dict[str, Any]:
+        """Send one generate request to ``endpoint`` and report the outcome to the pool."""
+        sent = time.time()
+        error = True
+        cancelled = False
+        try:
+            # Hedged and early-stopping requests always stream so they can be cut off mid-generation
+            if self.stream or cancel is not None or stop_when is not None:
+                result = self._generate_streaming(payload, start_time, endpoint.client, cancel, stop_when)
+            else:
+                result = endpoint.client.generate(payload, timeout=self.timeout)
+            error = False
+            return result
+        except HedgeCancelled:
+            cancelled = True
+            raise
+        finally:
+            self.endpoints.release(endpoint, time.time() - sent, error=error, cancelled=cancelled)
+    
+    def _send_hedge(
+        self,
+        payload: Dict[str, Any],
+        start_time: float,
+        exclude: Endpoint,
+        cancel: _Cancellation,
+        stop_when: Optional[Callable[[str], bool]] = None
+    ) -> Dict[str, Any]:
+        """Send the hedged duplicate of a request, holding its own adaptive-limiter slot."""
+        token = self.limiter.acquire() if self.limiter is not None else None
+        sent = time.time()
+        error = True
+        cancelled = False
+        try:
+            if cancel.is_set():
+                # The primary answered while we waited for a slot
+                raise HedgeCancelled()
+            endpoint = self.endpoints.acquire(exclude=exclude)
+            result = self._send_to(endpoint, payload, start_time, cancel, stop_when)
+            error = False
+            return result
+        except HedgeCancelled:
+            cancelled = True
+            raise
+        finally:
+            if token is not None:
+                self.limiter.release(token, time.time() - sent, error=error, cancelled=cancelled)
+    
+    def _hedge_delay(self) -> Optional[float]:
+        """Latency percentile after which a duplicate request is sent (None = don't hedge)."""
+        if self.hedge_percentile is None or len(self._latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(self.hedge_percentile * len(ordered)))]
+    
+    def _send(
+        self,
+        payload: Dict[str, Any],
+        start_time: float,
+        affinity_key: Optional[str],
+        stop_when: Optional[Callable[[str], bool]] = None
+    ) -> Dict[str, Any]:
+        """Send a request to an endpoint chosen by the load balancer, hedging if enabled."""
+        sent = time.time()
+        primary_endpoint = self.endpoints.acquire(affinity_key if self.sticky_prefix else None)
+        
+        with self._hedge_lock:
+            delay = self._hedge_delay()
+        if delay is None:
+            result = self._send_to(primary_endpoint, payload, start_time, stop_when=stop_when)
+            if self.hedge_percentile is not None:
+                with self._hedge_lock:
+                    self._latencies.append(time.time() - sent)
+            return result
+        
+        cancels = {}
+        primary_cancel = _Cancellation()
+        primary = self._hedge_executor.submit(
+            self._send_to, primary_endpoint, payload, start_time, primary_cancel, stop_when
+        )
+        cancels[primary] = primary_cancel
+        
+        done, _ = wait([primary], timeout=delay)
+        hedge = None
+        if not done:
+            hedge_cancel = _Cancellation()
+            hedge = self._hedge_executor.submit(
+                self._send_hedge, payload, start_time, primary_endpoint, hedge_cancel, stop_when
+            )
+            cancels[hedge] = hedge_cancel
+            with self._hedge_lock:
+                self.hedges_issued += 1
+        
+        first_error: Optional[BaseException] = None
+        pending = set(cancels)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    first_error = first_error or future.exception()
+                    continue
+                # First successful answer wins; cancel whatever is still running
+                for other in pending:
+                    cancels[other].set()
+                with self._hedge_lock:
+                    self._latencies.append(time.time() - sent)
+                    if future is hedge:
+                        self.hedges_won += 1
+                result = future.result()
+                result['hedged'] = hedge is not None
+                result['hedge_won'] = future is hedge
+                return result
+        raise first_error
+    
+    def _generate(
+        self,
+        payload: Dict[str, Any],
+        start_time: float,
+        affinity_key: Optional[str] = None,
+        stop_when: Optional[Callable[[str], bool]] = None
+    ) -> Dict[str, Any]:
+        """Send one generate request, gated by the adaptive limiter if configured.
+        
+        Timings (TTFT included) run from ``start_time`` so they cover the wait
+        for a limiter slot like latency does; the wait itself is reported as
+        ``limiter_wait``, and the limiter only sees the request's own latency.
+        """
+        if self.limiter is None:
+            return self._send(payload, start_time, affinity_key, stop_when)
+        
+        token = self.limiter.acquire()
+        sent = time.time()
+        error = True
+        try:
+            result = self._send(payload, start_time, affinity_key, stop_when)
+            result["limiter_wait"] = sent - start_time
+            error = False
+            return result
+        finally:
+            self.limiter.release(token, time.time() - sent, error=error)
     
     def query(self, context: str, question: str, **kwargs) -> Dict[str, Any]:
         """Query Ollama with real LLM."""
         start_time = time.time()
         
-        # Build prompt
-        prompt = f"Context: {context}\n\nQuestion: {question}\n\nAnswer briefly:"
+        payload = self._build_payload(context, question, kwargs.get('format'))
+        prefix_key = content_hash(self._prompt_prefix(context))
+        stop_when = self._stop_condition(self._stop_on(kwargs))
         
         try:
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json={
-                    "model": self.model_name,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": self.temperature,
-                        "num_predict": self.max_tokens
-                    }
-                },
-                timeout=self.timeout
-            )
-            response.raise_for_status()
-            
-            result = response.json()
+            result = self._generate(payload, start_time, affinity_key=prefix_key, stop_when=stop_when)
             llm_response = result.get('response', '').strip()
+            if result.get('stopped_early') and self.stop:
+                # Match the server's behaviour of not returning the stop sequence itself
+                llm_response = _truncate_at_stop(llm_response, self.stop)
             
             # Calculate latency
             latency = time.time() - start_time
             
-            # Token count (approximate)
-            token_count = len(context.split())
+            # Token count: prefer the server's exact prompt count, else the memoized approximation
+            prefill_tokens_saved, prefill_warm = self._account_prefill(prefix_key, payload['prompt'], result)
+            token_count = self.token_counter.count(payload['prompt'])
+            
+            # Structured output: check the 'answer' field instead of scanning the whole text
+            parsed = parse_json_response(llm_response) if "format" in payload else None
+            answer = parsed['answer'] if isinstance(parsed, dict) and 'answer' in parsed else llm_response
             
             # Check accuracy if expected answer provided
             expected = kwargs.get('expected_answer', kwargs.get('needle_fact', ''))
             is_accurate = False
             if expected:
-                is_accurate = expected.lower() in llm_response.lower()
+                is_accurate = expected.lower() in str(answer).lower()
             
-            return {
+            output = {
                 "response": llm_response,
                 "latency": latency,
                 "token_count": token_count,
-                "is_accurate": is_accurate
+                "output_tokens": (result.get('eval_count') or result.get('output_tokens')
+                                  or self.token_counter.count(llm_response)),
+                "prefill_tokens_saved": prefill_tokens_saved,
+                "prefill_warm": prefill_warm,
+                "is_accurate": is_accurate,
+                **server_timing(result, latency)
             }
+            if self.stream:
+                for key in ("ttft", "inter_token_latency", "tokens_per_second", "output_tokens"):
+                    output[key] = result[key]
+            if "format" in payload:
+                output["parsed"] = parsed
+            if stop_when is not None:
+                # Upper bound: decoding would otherwise have run to max_tokens
+                output["stopped_early"] = result.get('stopped_early', False)
+                output["decode_tokens_saved"] = (
+                    max(0, self.max_tokens - output["output_tokens"]) if output["stopped_early"] else 0
+                )
+            if self.limiter is not None:
+                output["limiter_wait"] = result["limiter_wait"]
+            if self.hedge_percentile is not None:
+                output["hedged"] = result.get('hedged', False)
+                output["hedge_won"] = result.get('hedge_won', False)
+            return output
             
         except Exception as e:
             return {
                 "response": f"Error: {str(e)}",
                 "latency": time.time() - start_time,
-                "token_count": len(context.split()),
-                "is_accurate": False
+                "token_count": self.token_counter.count(payload['prompt']),
+                "is_accurate": False,
+                "error": str(e)
             }
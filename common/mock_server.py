@@ -0,0 +1,342 @@
+"""Local stand-in for the Ollama HTTP API (record / replay / synthesize).
+
+Implements enough of ``/api/generate`` for the experiment harness to run
+without a model, e.g. on CI machines:
+
+- ``record``: proxy every request to a real Ollama and append the request,
+  response and elapsed time to a JSONL recordings file.
+- ``replay``: answer from a recordings file, reproducing the recorded timing.
+- ``synth``: synthesize responses with the MockLLM latency model.
+
+Usage:
+    python -m common.mock_server --mode synth --port 11435
+    python -m common.mock_server --mode record --upstream http://localhost:11434 --recordings rec.jsonl
+    python -m common.mock_server --mode replay --recordings rec.jsonl --time-scale 0.1
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, Optional, Iterator, Union
+
+from .llm import MockLLM, get_ollama_client
+from .cache import signature_hash
+from .tokens import count_tokens
+
+MODES = ("synth", "replay", "record")
+
+
+def recording_key(payload: Dict[str, Any]) -> str:
+    """Key a generate request by what determines its output."""
+    signature = {
+        "model": payload.get("model"),
+        "prompt": payload.get("prompt"),
+        "options": payload.get("options", {})
+    }
+    # Only when sent, so free-text recordings keep their keys
+    for field in ("format", "system"):
+        if payload.get(field) is not None:
+            signature[field] = payload[field]
+    return signature_hash(signature)
+
+
+def synthesize_json(format: Union[str, Dict[str, Any]], text: str) -> Dict[str, Any]:
+    """Shape a synthesized answer to a requested ``format`` ("json" or a JSON schema)."""
+    properties = format.get("properties", {}) if isinstance(format, dict) else {}
+    if not properties:
+        return {"answer": text}
+    return {name: [] if spec.get("type") == "array" else text for name, spec in properties.items()}
+
+
+class MockOllamaServer:
+    """
+    Threaded HTTP server speaking a subset of the Ollama API.
+
+    Can be run from the command line or embedded in-process::
+
+        with MockOllamaServer(mode="synth", port=0) as server:
+            llm = OllamaLLM(base_url=server.url)
+    """
+
+    def __init__(
+        self,
+        mode: str = "synth",
+        host: str = "127.0.0.1",
+        port: int = 11435,
+        recordings_path: Optional[Union[str, Path]] = None,
+        upstream_url: str = "http://localhost:11434",
+        time_scale: float = 1.0,
+        llm: Optional[MockLLM] = None,
+        num_parallel: int = 0
+    ):
+        """
+        Args:
+            mode: One of 'synth', 'replay', 'record'
+            host: Interface to bind
+            port: Port to bind (0 picks a free one)
+            recordings_path: JSONL file to write (record) or read (replay)
+            upstream_url: Real Ollama server proxied in record mode
+            time_scale: Multiplier on simulated/replayed latency (0 = no sleeping)
+            llm: MockLLM providing the latency model in synth mode
+            num_parallel: Requests served at once, like OLLAMA_NUM_PARALLEL
+                          (0 = unlimited); extra requests queue
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode '{mode}', expected one of {MODES}")
+        if mode in ("replay", "record") and recordings_path is None:
+            raise ValueError(f"Mode '{mode}' requires a recordings_path")
+
+        self.mode = mode
+        self.recordings_path = Path(recordings_path) if recordings_path else None
+        self.upstream_url = upstream_url
+        self.time_scale = time_scale
+        self.llm = llm or MockLLM()
+        self.request_count = 0
+        self._slots = threading.Semaphore(num_parallel) if num_parallel > 0 else None
+
+        self._lock = threading.Lock()
+        self._recordings: Dict[str, Dict[str, Any]] = {}
+        if mode == "replay":
+            self._load_recordings()
+
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _load_recordings(self):
+        with open(self.recordings_path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._recordings[record["key"]] = record
+
+    # --- Response generation ---
+
+    def generate(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Produce the final /api/generate body for a request.
+
+        Returns:
+            Dict with the Ollama response fields plus '_elapsed', the
+            (unscaled) seconds the response should take to serve
+        """
+        with self._lock:
+            self.request_count += 1
+
+        if self.mode == "synth":
+            return self._synthesize(payload)
+        if self.mode == "replay":
+            record = self._recordings.get(recording_key(payload))
+            if record is None:
+                raise KeyError("No recording for this request")
+            return {**record["response"], "_elapsed": record["elapsed"]}
+        return self._record(payload)
+
+    def _synthesize(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        prompt = payload.get("prompt", "")
+        if not prompt:
+            # Ollama treats an empty prompt as "load the model" and returns at once
+            return {
+                "model": payload.get("model", "mock"),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "response": "",
+                "done": True,
+                "done_reason": "unload" if payload.get("keep_alive") == 0 else "load",
+                "_elapsed": 0.0
+            }
+        result = self.llm.simulate(context=prompt, question="")
+        if payload.get("format"):
+            result["response"] = json.dumps(synthesize_json(payload["format"], result["response"]))
+        latency = result["latency"]
+        prefill = min(latency, self.llm.latency_base + result["token_count"] * self.llm.latency_per_token)
+        eval_count = count_tokens(result["response"])
+        return {
+            "model": payload.get("model", "mock"),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "response": result["response"],
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int(latency * 1e9),
+            "load_duration": 0,
+            "prompt_eval_count": result["token_count"],
+            "prompt_eval_duration": int(prefill * 1e9),
+            "eval_count": eval_count,
+            "eval_duration": int((latency - prefill) * 1e9),
+            "_elapsed": latency
+        }
+
+    def _record(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        client = get_ollama_client(self.upstream_url)
+        start = time.perf_counter()
+        body = client.generate({**payload, "stream": False}, timeout=600)
+        elapsed = time.perf_counter() - start
+
+        record = {"key": recording_key(payload), "request": payload, "response": body, "elapsed": elapsed}
+        with self._lock:
+            with open(self.recordings_path, 'a') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # The upstream call already took real time; don't sleep again
+        return {**body, "_elapsed": 0.0}
+
+    def stream_chunks(self, body: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Split a final response into Ollama-style NDJSON stream chunks."""
+        words = body.get("response", "").split(" ")
+        for i, word in enumerate(words):
+            yield {
+                "model": body.get("model"),
+                "created_at": body.get("created_at"),
+                "response": word if i == 0 else " " + word,
+                "done": False
+            }
+        yield {**body, "response": ""}
+
+    # --- HTTP plumbing ---
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; without TCP_NODELAY,
+            # Nagle + delayed ACK stalls every reused keep-alive connection ~40ms
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, body: Dict[str, Any]):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _write_chunk(self, data: bytes):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path == "/api/version":
+                    self._send_json(200, {"version": f"mock-{server.mode}"})
+                elif self.path == "/api/tags":
+                    self._send_json(200, {"models": []})
+                else:
+                    self._send_json(404, {"error": f"unknown path {self.path}"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError as e:
+                    self._send_json(400, {"error": f"invalid JSON: {e}"})
+                    return
+
+                if self.path != "/api/generate":
+                    self._send_json(404, {"error": f"unknown path {self.path}"})
+                    return
+
+                if server._slots is not None:
+                    server._slots.acquire()
+                try:
+                    self._serve_generate(payload)
+                finally:
+                    if server._slots is not None:
+                        server._slots.release()
+
+            def _serve_generate(self, payload: Dict[str, Any]):
+                try:
+                    body = server.generate(payload)
+                except KeyError as e:
+                    self._send_json(404, {"error": str(e)})
+                    return
+                except Exception as e:
+                    self._send_json(502, {"error": str(e)})
+                    return
+
+                delay = body.pop("_elapsed") * server.time_scale
+
+                # Ollama streams unless told otherwise
+                if not payload.get("stream", True):
+                    time.sleep(delay)
+                    self._send_json(200, body)
+                    return
+
+                chunks = list(server.stream_chunks(body))
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for chunk in chunks:
+                        time.sleep(delay / len(chunks))
+                        self._write_chunk((json.dumps(chunk) + "\n").encode("utf-8"))
+                    self.wfile.write(b"0\r\n\r\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client hung up (e.g. a cancelled hedge); stop generating like Ollama does
+                    self.close_connection = True
+
+        return Handler
+
+    def start(self) -> "MockOllamaServer":
+        """Serve on a background thread."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self) -> "MockOllamaServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local Ollama stand-in (record / replay / synth)")
+    parser.add_argument("--mode", choices=MODES, default="synth")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--recordings", help="JSONL recordings file (record/replay)")
+    parser.add_argument("--upstream", default="http://localhost:11434", help="Real Ollama URL (record)")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Latency multiplier (0 = no sleeping)")
+    parser.add_argument("--num-parallel", type=int, default=0, help="Concurrent requests served (0 = unlimited)")
+    args = parser.parse_args(argv)
+
+    server = MockOllamaServer(
+        mode=args.mode,
+        host=args.host,
+        port=args.port,
+        recordings_path=args.recordings,
+        upstream_url=args.upstream,
+        time_scale=args.time_scale,
+        num_parallel=args.num_parallel
+    )
+    print(f"Mock Ollama ({args.mode}) listening on {server.url}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
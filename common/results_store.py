@@ -0,0 +1,309 @@
+"""Columnar results storage and a SQLite index of experiment runs."""
+
+import json
+import sqlite3
+import subprocess
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from .utils import config_hash
+
+# Run index kept next to the JSON results in every results directory
+RUN_INDEX_NAME = "run_index.sqlite"
+
+
+@lru_cache(maxsize=1)
+def git_revision() -> Optional[str]:
+    """Commit the experiments are running from, or None outside a git checkout."""
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).parent, capture_output=True, text=True, timeout=5
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return completed.stdout.strip() or None
+
+
+def flatten_record(record: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """Flatten nested dicts into dotted scalar columns; lists are dropped."""
+    flat = {}
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_record(value, prefix=f"{name}."))
+        elif value is None or isinstance(value, (bool, int, float, str)):
+            flat[name] = value
+    return flat
+
+
+def _is_table(value: Any) -> bool:
+    return isinstance(value, list) and bool(value) and all(isinstance(item, dict) for item in value)
+
+
+def extract_tables(results: Any) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Find the per-item record lists in a results object.
+
+    - a top-level list of dicts becomes table "records"
+    - a list of dicts under a key becomes that key (task1 documents, task2 results, task3 raw results)
+    - a dict of such lists becomes "key.sub" (task4 trials per strategy)
+    """
+    if _is_table(results):
+        return {"records": [flatten_record(r) for r in results]}
+    tables = {}
+    if isinstance(results, dict):
+        for key, value in results.items():
+            if _is_table(value):
+                tables[key] = [flatten_record(r) for r in value]
+            elif isinstance(value, dict):
+                for sub, rows in value.items():
+                    if _is_table(rows):
+                        tables[f"{key}.{sub}"] = [flatten_record(r) for r in rows]
+    return tables
+
+
+def _column(values: List[Any]) -> Any:
+    """Normalize one column to a homogeneous numpy array (missing numbers become NaN)."""
+    import numpy as np
+    present = [v for v in values if v is not None]
+    if all(isinstance(v, bool) for v in present) and len(present) == len(values):
+        return np.asarray(values, dtype=bool)
+    if all(isinstance(v, (int, float)) for v in present):
+        if len(present) == len(values) and all(isinstance(v, int) for v in present):
+            return np.asarray(values, dtype=np.int64)
+        return np.asarray([np.nan if v is None else v for v in values], dtype=np.float64)
+    return np.asarray(["" if v is None else str(v) for v in values], dtype=str)
+
+
+def write_tables(tables: Dict[str, List[Dict[str, Any]]], directory: Path) -> str:
+    """
+    Write each table as a columnar file: Parquet if pyarrow is installed,
+    otherwise one .npz per table with an array per column.
+
+    Returns:
+        The format used ("parquet" or "npz")
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        pa = None
+
+    for name, rows in tables.items():
+        columns = {}
+        for row in rows:
+            for column in row:
+                columns.setdefault(column, None)
+        arrays = {column: _column([row.get(column) for row in rows]) for column in columns}
+        if pa is not None:
+            pq.write_table(pa.table(arrays), directory / f"{name}.parquet")
+        else:
+            import numpy as np
+            np.savez_compressed(directory / f"{name}.npz", **arrays)
+    return "parquet" if pa is not None else "npz"
+
+
+def read_table(directory: Union[str, Path], name: str, format: str, columns: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """
+    Read a table written by ``write_tables``, loading only the requested columns.
+
+    Requested columns the table lacks (e.g. from runs predating them) are omitted.
+
+    Returns:
+        Dict of column name -> numpy array
+    """
+    directory = Path(directory)
+    if format == "parquet":
+        import pyarrow.parquet as pq
+        path = directory / f"{name}.parquet"
+        if columns is not None:
+            available = set(pq.read_schema(path).names)
+            columns = [column for column in columns if column in available]
+        table = pq.read_table(path, columns=columns)
+        return {column: table.column(column).to_numpy(zero_copy_only=False) for column in table.column_names}
+
+    import numpy as np
+    # NpzFile decompresses members on access, so unrequested columns are never read
+    with np.load(directory / f"{name}.npz") as npz:
+        if columns is None:
+            columns = npz.files
+        return {column: npz[column] for column in columns if column in npz.files}
+
+
+class RunIndex:
+    """
+    SQLite catalogue of experiment runs in one results directory.
+
+    Each run records its experiment name, config hash, git revision and
+    timestamp, plus where its JSON and columnar tables live, so reports can
+    pick runs by query instead of globbing files by ctime, and aggregate
+    columns across many runs without parsing their JSON. File paths are
+    stored relative to the index and resolved against its directory, so
+    runs load from any working directory (and the directory can be moved).
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        Args:
+            path: SQLite database file (created if missing)
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._root = self.path.parent.resolve()
+        self._conn = sqlite3.connect(str(self.path))
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                experiment TEXT,
+                config_hash TEXT,
+                git_rev TEXT,
+                timestamp TEXT NOT NULL,
+                json_path TEXT NOT NULL,
+                columns_path TEXT,
+                format TEXT,
+                tables TEXT
+            );
+            CREATE INDEX IF NOT EXISTS runs_by_time ON runs (experiment, timestamp);
+            CREATE INDEX IF NOT EXISTS runs_by_config ON runs (config_hash);
+        """)
+
+    def add(self, run: Dict[str, Any]):
+        """Insert (or replace) a run row."""
+        row = {**run, "tables": json.dumps(run.get("tables", []))}
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO runs VALUES "
+                "(:run_id, :experiment, :config_hash, :git_rev, :timestamp, :json_path, :columns_path, :format, :tables)",
+                row
+            )
+
+    def runs(
+        self,
+        experiment: Optional[str] = None,
+        config_hash: Optional[str] = None,
+        git_rev: Optional[str] = None,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Runs matching every given filter, newest first."""
+        filters = {"experiment": experiment, "config_hash": config_hash, "git_rev": git_rev}
+        clauses = [f"{column} = :{column}" for column, value in filters.items() if value is not None]
+        sql = "SELECT * FROM runs"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY timestamp DESC"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        rows = self._conn.execute(sql, filters).fetchall()
+        return [self.resolve({**dict(row), "tables": json.loads(row["tables"] or "[]")}) for row in rows]
+
+    def resolve(self, run: Dict[str, Any]) -> Dict[str, Any]:
+        """Copy of a run row with its file paths resolved against the index directory."""
+        run = dict(run)
+        for key in ("json_path", "columns_path"):
+            if run.get(key) is not None:
+                run[key] = str(self._root / run[key])
+        return run
+
+    def latest(self, **filters) -> Optional[Dict[str, Any]]:
+        """Most recent run matching the filters (see ``runs``), or None."""
+        runs = self.runs(limit=1, **filters)
+        return runs[0] if runs else None
+
+    @staticmethod
+    def load_results(run: Dict[str, Any]) -> Any:
+        """Full JSON results of a run."""
+        with open(run["json_path"], 'r') as f:
+            return json.load(f)
+
+    @staticmethod
+    def load_table(run: Dict[str, Any], table: str, columns: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """Columns of one of a run's tables (all columns if None; missing ones are omitted)."""
+        return read_table(run["columns_path"], table, run["format"], columns)
+
+    def aggregate(self, table: str, columns: Sequence[str], **filters) -> Dict[str, Any]:
+        """
+        Concatenate columns of a table across every matching run.
+
+        Runs that lack some of the columns get NaN ("" for text columns) in
+        their rows; runs that have none of them are skipped.
+
+        Returns:
+            Dict of column -> numpy array, plus 'run_id' identifying each row's run
+        """
+        import numpy as np
+        if not columns:
+            raise ValueError("aggregate needs at least one column")
+        loaded = []
+        for run in self.runs(**filters):
+            if table not in run["tables"]:
+                continue
+            data = self.load_table(run, table, columns)
+            if data:
+                loaded.append((run["run_id"], len(next(iter(data.values()))), data))
+        if not loaded:
+            return {column: np.array([]) for column in ("run_id", *columns)}
+
+        aggregated = {"run_id": np.concatenate([np.full(rows, run_id) for run_id, rows, _ in loaded])}
+        for column in columns:
+            present = [data[column] for _, _, data in loaded if column in data]
+            fill = "" if any(array.dtype.kind in "US" for array in present) else np.nan
+            aggregated[column] = np.concatenate([
+                data[column] if column in data else np.full(rows, fill) for _, rows, data in loaded
+            ])
+        return aggregated
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self) -> "RunIndex":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def record_run(
+    results: Any,
+    json_path: Path,
+    config: Optional[Dict[str, Any]] = None,
+    experiment: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Write a run's tables in columnar form and add it to its directory's RunIndex.
+
+    Args:
+        results: Results object that was saved as JSON
+        json_path: Where the JSON was written (its stem becomes the run id)
+        config: Full experiment config (defaults to results['config'])
+        experiment: Experiment name (defaults to the config's name)
+
+    Returns:
+        The run index row, with resolved paths
+    """
+    if config is None and isinstance(results, dict) and isinstance(results.get("config"), dict):
+        config = results["config"]
+    if experiment is None and config:
+        experiment = (config.get("experiment") or {}).get("name") or config.get("name")
+
+    tables = extract_tables(results)
+    # Paths are stored relative to the index, which lives next to the JSON
+    columns_path = Path("columns") / json_path.stem
+    run = {
+        "run_id": json_path.stem,
+        "experiment": experiment,
+        "config_hash": config_hash(config) if config else None,
+        "git_rev": git_revision(),
+        "timestamp": datetime.now().isoformat(),
+        "json_path": json_path.name,
+        "columns_path": str(columns_path) if tables else None,
+        "format": write_tables(tables, json_path.parent / columns_path) if tables else None,
+        "tables": sorted(tables)
+    }
+    with RunIndex(json_path.parent / RUN_INDEX_NAME) as index:
+        index.add(run)
+        return index.resolve(run)
@@ -0,0 +1,104 @@
+"""Token accounting shared by all experiments."""
+
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+# Word pieces and individual punctuation marks, roughly how BPE tokenizers split text
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+# Average characters per sub-word token for long words
+_CHARS_PER_TOKEN = 4
+
+
+def content_hash(text: str) -> str:
+    """Stable digest of a text, used as a memoization key."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def approximate_token_count(text: str) -> int:
+    """
+    Offline tokenizer approximation.
+
+    Counts punctuation as one token each and splits words into sub-word
+    pieces of ~4 characters, which tracks BPE tokenizers (e.g. Llama 3)
+    far better than a plain word count.
+    """
+    count = 0
+    for piece in _PIECE_RE.findall(text):
+        count += max(1, -(-len(piece) // _CHARS_PER_TOKEN))
+    return count
+
+
+class TokenCounter:
+    """
+    Memoized token counts keyed by content hash.
+
+    Counts reported by the model server (Ollama's ``prompt_eval_count`` /
+    ``eval_count``) are recorded with ``record()`` and take precedence over
+    the local approximation for the same text.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self._exact: set = set()
+        self._lock = threading.Lock()
+
+    def _store(self, key: str, count: int):
+        self._counts[key] = count
+        self._counts.move_to_end(key)
+        while len(self._counts) > self.max_entries:
+            evicted, _ = self._counts.popitem(last=False)
+            self._exact.discard(evicted)
+
+    def count(self, text: str) -> int:
+        """Return the token count of ``text``, computing it at most once per content."""
+        key = content_hash(text)
+        with self._lock:
+            if key in self._counts:
+                self._counts.move_to_end(key)
+                return self._counts[key]
+
+        count = approximate_token_count(text)
+        with self._lock:
+            # A server count may have been recorded while we were counting
+            if key not in self._exact:
+                self._store(key, count)
+            return self._counts[key]
+
+    def record(self, text: str, count: int):
+        """Record an exact, server-reported token count for ``text``."""
+        key = content_hash(text)
+        with self._lock:
+            # Servers that reuse a cached prefix report fewer evaluated tokens,
+            # so the largest observation is the true count
+            if key in self._exact:
+                count = max(count, self._counts.get(key, 0))
+            self._store(key, count)
+            self._exact.add(key)
+
+    def is_exact(self, text: str) -> bool:
+        """Whether the count for ``text`` came from the model server."""
+        with self._lock:
+            return content_hash(text) in self._exact
+
+
+_default_counter: Optional[TokenCounter] = None
+_default_lock = threading.Lock()
+
+
+def get_token_counter() -> TokenCounter:
+    """Process-wide shared TokenCounter."""
+    global _default_counter
+    with _default_lock:
+        if _default_counter is None:
+            _default_counter = TokenCounter()
+        return _default_counter
+
+
+def count_tokens(text: str) -> int:
+    """Token count of ``text`` using the shared counter."""
+    return get_token_counter().count(text)
@@ -1,27 +1,48 @@
 """Common utilities for all experiments."""
 
+import os
 import sys
 import yaml
 import random
+import atexit
 import logging
+import logging.handlers
+import copy
 import json
+import hashlib
+import threading
+from queue import SimpleQueue
 from pathlib import Path
-from typing import Dict, Any, Optional, List, Union
+from typing import Dict, Any, Optional, List, Union, Sequence
 from dataclasses import dataclass, asdict
 
 # --- Logging ---
 
+# Background listeners started by setup_logger(queue=True), by logger name
+_LISTENERS: Dict[str, logging.handlers.QueueListener] = {}
+
 def setup_logger(
     name: str,
     log_dir: Optional[Path] = None,
     level: str = "INFO",
     console: bool = True,
-    file: bool = True
+    file: bool = True,
+    queue: bool = False
 ) -> logging.Logger:
-    """Configure and return a logger instance."""
+    """
+    Configure and return a logger instance.
+    
+    With ``queue=True`` the logger only enqueues records; a background
+    QueueListener thread runs the console/file handlers (formatting and
+    I/O), so logging never blocks the threads issuing requests. Records are
+    enqueued unformatted (see _DeferredQueueHandler). The listener is
+    flushed and stopped at interpreter exit.
+    """
     logger = logging.getLogger(name)
     logger.setLevel(level.upper())
     logger.handlers = []  # Clear existing handlers
+    if name in _LISTENERS:
+        _LISTENERS.pop(name).stop()
 
     formatter = logging.Formatter(
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -39,8 +60,43 @@ def setup_logger(
         file_handler.setFormatter(formatter)
         logger.addHandler(file_handler)
 
+    if queue and logger.handlers:
+        handlers, logger.handlers = logger.handlers, []
+        records = SimpleQueue()
+        logger.addHandler(_DeferredQueueHandler(records))
+        listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        listener.start()
+        _LISTENERS[name] = listener
+
     return logger
 
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread.
+    
+    The stock ``prepare()`` formats every record in the calling thread so it
+    can be pickled; our queue is in-process, so the raw record is enqueued.
+    Only %-style args that could change before the listener formats them
+    (anything but plain scalars) are merged into the message up front.
+    """
+    
+    _IMMUTABLE = (str, bytes, int, float, bool, type(None))
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        # A lone dict argument becomes ``args`` itself, and may be mutated later
+        if args and (isinstance(args, dict) or not all(isinstance(value, self._IMMUTABLE) for value in args)):
+            record = copy.copy(record)
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+def _stop_listeners():
+    while _LISTENERS:
+        _LISTENERS.popitem()[1].stop()
+
+atexit.register(_stop_listeners)
+
 # --- Reproducibility ---
 
 def set_seed(seed: int = 42):
@@ -49,6 +105,25 @@ def set_seed(seed: int = 42):
     # np.random.seed(seed) # Removed numpy
     # torch.manual_seed(seed) # If torch is added later
 
+def spawn_rngs(seed: int, n: int) -> List[random.Random]:
+    """
+    Derive ``n`` independent, reproducible RNG streams from one seed.
+    
+    Uses numpy's SeedSequence spawning, so stream i depends only on
+    (seed, i): work items can run in any order, on any thread or process,
+    and still generate identical data.
+    
+    Args:
+        seed: Experiment seed
+        n: Number of streams (e.g. one per trial)
+        
+    Returns:
+        List of random.Random instances, one per stream
+    """
+    import numpy as np
+    children = np.random.SeedSequence(seed).spawn(n)
+    return [random.Random(int.from_bytes(child.generate_state(4).tobytes(), "little")) for child in children]
+
 # --- Configuration Base ---
 
 def load_yaml_config(config_path: Path) -> Dict[str, Any]:
@@ -65,8 +140,25 @@ def save_yaml_config(config_data: Dict[str, Any], output_path: Path):
 
 # --- I/O & Reporting ---
 
-def save_json_results(results: Dict[str, Any], output_dir: Path, filename_prefix: str = "results"):
-    """Save results to JSON with timestamp."""
+def save_json_results(
+    results: Dict[str, Any],
+    output_dir: Path,
+    filename_prefix: str = "results",
+    config: Optional[Dict[str, Any]] = None
+):
+    """
+    Save results to JSON with timestamp.
+    
+    Also writes the results' per-item tables in columnar form and registers
+    the run (config hash, git revision, timestamp) in the directory's
+    run index; see common.results_store.
+    
+    Args:
+        results: Results object
+        output_dir: Results directory
+        filename_prefix: File name prefix
+        config: Full experiment config for the run index (defaults to results['config'])
+    """
     output_dir.mkdir(parents=True, exist_ok=True)
     from datetime import datetime
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -80,5 +172,115 @@ def save_json_results(results: Dict[str, Any], output_dir: Path, filename_prefix
     with open(output_dir / filename, 'w') as f:
         json.dump(results, f, indent=2, default=default_serializer)
     
+    from .results_store import record_run
+    record_run(results, output_dir / filename, config=config)
+    
     return output_dir / filename
 
+def config_hash(config: Dict[str, Any], exclude: Sequence[str] = ("logging", "output")) -> str:
+    """Short, stable digest of an experiment config, ignoring sections that don't affect results."""
+    relevant = {k: v for k, v in config.items() if k not in exclude}
+    canonical = json.dumps(relevant, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+def _failed(record: Any) -> bool:
+    """Whether a record, or any dict nested in it, has an ``error`` set."""
+    if not isinstance(record, dict):
+        return False
+    return bool(record.get("error")) or any(_failed(value) for value in record.values())
+
+class ResultsSink:
+    """
+    Append-only JSONL log of finished work items (trials, test cases).
+    
+    Each completed item is written as one line the moment it finishes and
+    flushed to the OS, so a crashed process loses nothing already recorded;
+    fsync is batched every ``fsync_every`` records to bound what a power
+    loss can take. The file is named by the config hash, and with
+    ``resume=True`` the records already in it are loaded so runners can
+    skip completed keys and restart a long sweep where it stopped.
+    Records carrying an ``error`` (at any level, e.g. a failed LLM call
+    inside a trial) are kept in the log but not loaded, so a resumed run
+    retries them.
+    """
+    
+    def __init__(
+        self,
+        output_dir: Path,
+        config: Dict[str, Any],
+        filename_prefix: str = "trials",
+        resume: bool = False,
+        fsync_every: int = 8
+    ):
+        """
+        Args:
+            output_dir: Directory for the JSONL file
+            config: Experiment config (hashed to name the file)
+            filename_prefix: File name prefix
+            resume: Load and keep existing records instead of starting over
+            fsync_every: Records between fsync calls
+        """
+        output_dir.mkdir(parents=True, exist_ok=True)
+        self.config_hash = config_hash(config)
+        self.path = output_dir / f"{filename_prefix}_{self.config_hash}.jsonl"
+        self.fsync_every = max(1, fsync_every)
+        self.completed: Dict[str, Any] = {}
+        self._unsynced = 0
+        self._lock = threading.Lock()
+        
+        if resume and self.path.exists():
+            self._load()
+        self._file = open(self.path, 'a' if resume else 'w', encoding='utf-8')
+        if resume and self.path.stat().st_size and not self._ends_with_newline():
+            # Terminate a line torn by a crash so the next record starts clean
+            self._file.write("\n")
+    
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Partial line from an interrupted write
+                if _failed(entry["record"]):
+                    continue
+                self.completed[entry["key"]] = entry["record"]
+    
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+    
+    def __contains__(self, key: Any) -> bool:
+        return str(key) in self.completed
+    
+    def get(self, key: Any) -> Optional[Any]:
+        """Record stored for a completed key, or None."""
+        return self.completed.get(str(key))
+    
+    def write(self, key: Any, record: Any):
+        """Append one completed item (thread-safe)."""
+        line = json.dumps({"key": str(key), "config_hash": self.config_hash, "record": record},
+                          ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.completed[str(key)] = record
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every:
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+    
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+    
+    def __enter__(self) -> "ResultsSink":
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
@@ -1,29 +1,16 @@
-import json
-import glob
-import os
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 from pathlib import Path
 from typing import Dict, Any, List
 
+from results_loader import load_task1, load_task2, load_task3, load_task4
+
 # Setup style
 plt.style.use('ggplot')
 plt.rcParams['figure.figsize'] = [10, 6]
 plt.rcParams['font.size'] = 12
 
-def load_latest_result(task_dir: str) -> Dict[str, Any]:
-    """Load the most recent results.json file."""
-    search_path = os.path.join(task_dir, "results", "results_*.json")
-    files = glob.glob(search_path)
-    if not files:
-        fallback = os.path.join(task_dir, "results", "results.json")
-        if os.path.exists(fallback):
-            with open(fallback, 'r') as f: return json.load(f)
-        return {}
-    latest_file = max(files, key=os.path.getctime)
-    with open(latest_file, 'r') as f: return json.load(f)
-
 def generate_task1_graph(data: Dict[str, Any], output_path: str):
     if not data: return
     
@@ -153,11 +140,11 @@ def generate_task4_graph(data: Dict[str, Any], output_path: str):
 def main():
     root = Path(__file__).parent.parent
     
-    # Load Data
-    data1 = load_latest_result(str(root / "task1_experiment"))
-    data2 = load_latest_result(str(root / "task2_experiment"))
-    data3 = load_latest_result(str(root / "task3_experiment"))
-    data4 = load_latest_result(str(root / "task4_experiment"))
+    # Load Data (only the columns each graph plots, from the columnar store)
+    data1 = load_task1(str(root / "task1_experiment"))
+    data2 = load_task2(str(root / "task2_experiment"))
+    data3 = load_task3(str(root / "task3_experiment"))
+    data4 = load_task4(str(root / "task4_experiment"))
     
     # Generate Graphs
     out_dir = root / "presentation" / "images"
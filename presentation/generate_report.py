@@ -1,27 +1,9 @@
-import json
-import glob
-import os
 from pathlib import Path
 from typing import Dict, Any, List
 
-# --- Utility Functions ---
+from results_loader import load_task1, load_task2, load_task3, load_task4
 
-def load_latest_result(task_dir: str) -> Dict[str, Any]:
-    """Load the most recent results.json file from the given directory."""
-    search_path = os.path.join(task_dir, "results", "results_*.json")
-    files = glob.glob(search_path)
-    if not files:
-        # Fallback to standard results.json if timestamped one missing
-        fallback = os.path.join(task_dir, "results", "results.json")
-        if os.path.exists(fallback):
-            with open(fallback, 'r') as f:
-                return json.load(f)
-        return {}
-    
-    # Sort by modification time (or filename timestamp)
-    latest_file = max(files, key=os.path.getctime)
-    with open(latest_file, 'r') as f:
-        return json.load(f)
+# --- Utility Functions ---
 
 def draw_bar(value: float, max_value: float, width: int = 20) -> str:
     """Draw a unicode progress bar."""
@@ -84,10 +66,7 @@ def report_task1(data: Dict[str, Any]) -> str:
 def report_task2(data: Dict[str, Any]) -> str:
     if not data: return "No data found for Task 2."
     
-    # Data is a list of dicts in the root or under a key?
-    # Based on task2 code: save_json_results(results, ...) -> results is a list.
-    # But save_json_results might wrap it? No, common/utils.py dumps object directly.
-    # Let's check if it's a list or dict.
+    # Records live under 'results' (older runs saved a bare list)
     results = data if isinstance(data, list) else data.get('results', [])
     
     output = []
@@ -199,11 +178,11 @@ def report_task4(data: Dict[str, Any]) -> str:
 def main():
     root = Path(__file__).parent.parent
     
-    # Load Data
-    data1 = load_latest_result(str(root / "task1_experiment"))
-    data2 = load_latest_result(str(root / "task2_experiment"))
-    data3 = load_latest_result(str(root / "task3_experiment"))
-    data4 = load_latest_result(str(root / "task4_experiment"))
+    # Load Data (only the columns each report uses, from the columnar store)
+    data1 = load_task1(str(root / "task1_experiment"))
+    data2 = load_task2(str(root / "task2_experiment"))
+    data3 = load_task3(str(root / "task3_experiment"))
+    data4 = load_task4(str(root / "task4_experiment"))
     
     # Generate Reports
     rep1 = report_task1(data1)
@@ -0,0 +1,153 @@
+"""Load the latest experiment results for the report and graph scripts."""
+
+import sys
+import json
+import glob
+import os
+from pathlib import Path
+from typing import Dict, Any, Optional, Sequence
+
+# Add root to path to allow importing common
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from common import RunIndex, RUN_INDEX_NAME, load_yaml_config
+
+TASK2_COLUMNS = ['doc_count', 'estimated_tokens', 'latency', 'accuracy']
+TASK4_STRATEGIES = ['SELECT', 'COMPRESS', 'WRITE']
+
+
+def experiment_name(task_dir: str) -> Optional[str]:
+    """Name the task's runs are recorded under (from its config)."""
+    config_path = Path(task_dir) / "config" / "experiment.yaml"
+    if not config_path.exists():
+        return None
+    return (load_yaml_config(config_path).get('experiment') or {}).get('name')
+
+
+def latest_run(task_dir: str) -> Optional[Dict[str, Any]]:
+    """Most recent run of this task in its run index (None if it has none)."""
+    # Runs are registered in the results directory's run index by save_json_results;
+    # tasks sharing a results directory are told apart by experiment name
+    index_path = Path(task_dir) / "results" / RUN_INDEX_NAME
+    if not index_path.exists():
+        return None
+    with RunIndex(index_path) as index:
+        return index.latest(experiment=experiment_name(task_dir))
+
+
+def load_latest_result(task_dir: str) -> Dict[str, Any]:
+    """Load the most recent run's full JSON results from the given directory."""
+    run = latest_run(task_dir)
+    if run is not None:
+        return RunIndex.load_results(run)
+
+    # Results saved before the run index existed
+    search_path = os.path.join(task_dir, "results", "results_*.json")
+    files = glob.glob(search_path)
+    if not files:
+        # Fallback to standard results.json if timestamped one missing
+        fallback = os.path.join(task_dir, "results", "results.json")
+        if os.path.exists(fallback):
+            with open(fallback, 'r') as f:
+                return json.load(f)
+        return {}
+
+    # Sort by modification time (or filename timestamp)
+    latest_file = max(files, key=os.path.getctime)
+    with open(latest_file, 'r') as f:
+        return json.load(f)
+
+
+def load_latest_tables(task_dir: str, tables: Dict[str, Sequence[str]]) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Read only the given columns of the latest run's tables from its columnar store.
+
+    Returns:
+        Dict of table -> column -> numpy array, or None if the run is not
+        indexed or lacks one of the tables/columns
+    """
+    run = latest_run(task_dir)
+    if run is None or not all(table in run["tables"] for table in tables):
+        return None
+    loaded = {table: RunIndex.load_table(run, table, columns) for table, columns in tables.items()}
+    if any(set(data) != set(tables[table]) for table, data in loaded.items()):
+        return None
+    return loaded
+
+
+# --- Per-task data, shaped as the report and graph functions expect ---
+
+def load_task1(task_dir: str) -> Dict[str, Any]:
+    """Per-position accuracy, computed from the documents table."""
+    tables = load_latest_tables(task_dir, {'documents': ['position', 'score']})
+    if tables is None:
+        return load_latest_result(task_dir)
+    documents = tables['documents']
+
+    statistics = {}
+    for position in ['start', 'middle', 'end']:
+        scores = documents['score'][documents['position'] == position]
+        if len(scores):
+            statistics[position] = {
+                'accuracy': float(scores.mean()),
+                'count': int(len(scores)),
+                'correct': int(scores.sum())
+            }
+    return {'statistics': statistics}
+
+
+def load_task2(task_dir: str) -> Dict[str, Any]:
+    """One record per scaling level, read from the results table."""
+    tables = load_latest_tables(task_dir, {'results': TASK2_COLUMNS})
+    if tables is None:
+        return load_latest_result(task_dir)
+    columns = tables['results']
+    rows = zip(*(columns[column].tolist() for column in TASK2_COLUMNS))
+    return {'results': [dict(zip(TASK2_COLUMNS, row)) for row in rows]}
+
+
+def load_task3(task_dir: str) -> Dict[str, Any]:
+    """Average latency and accuracy of each mode, from the raw per-iteration tables."""
+    columns = ['latency', 'is_accurate']
+    tables = load_latest_tables(task_dir, {'raw_results_a': columns, 'raw_results_b': columns})
+    if tables is None:
+        return load_latest_result(task_dir)
+
+    def stats(data: Dict[str, Any]) -> Dict[str, float]:
+        return {
+            'avg_latency': float(data['latency'].mean()),
+            # Failed queries store no is_accurate (NaN) and count as wrong
+            'accuracy': float((data['is_accurate'] == 1).mean()) * 100.0,
+            'count': int(len(data['latency']))
+        }
+    return {'stats_a': stats(tables['raw_results_a']), 'stats_b': stats(tables['raw_results_b'])}
+
+
+def load_task4(task_dir: str) -> Dict[str, Any]:
+    """Each strategy's last trial: the runner's correct flag and the context it used."""
+    tables = load_latest_tables(
+        task_dir, {f"trials.{strategy}": ['correct', 'context_used'] for strategy in TASK4_STRATEGIES}
+    )
+    if tables is None:
+        results = load_latest_result(task_dir)
+        if 'trials' not in results:
+            return results
+        # Same shape from the JSON, for runs without columnar tables
+        tables = {
+            f"trials.{strategy}": {
+                'correct': [trial['correct'] for trial in trials],
+                'context_used': [trial.get('context_used', '') for trial in trials]
+            }
+            for strategy, trials in results['trials'].items() if trials
+        }
+
+    data = {}
+    for strategy in TASK4_STRATEGIES:
+        trials = tables.get(f"trials.{strategy}")
+        if trials is None:
+            continue
+        data[strategy.lower()] = {
+            'pass': bool(trials['correct'][-1]),
+            'context': str(trials['context_used'][-1])
+        }
+    return data
@@ -1,44 +1,25 @@
 """Task 1: Lost in the Middle Experiment."""
 
 import sys
-import requests
+from functools import partial
 from pathlib import Path
+from typing import Dict, Any
 
 # Add root to path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
-from common import setup_logger, set_seed, load_yaml_config, save_json_results, generate_text_block, insert_needle
+from common import setup_logger, set_seed, spawn_rngs, load_yaml_config, save_json_results, ResultsSink, run_concurrently, generate_text_block, TextDocument, OllamaLLM, AdaptiveConcurrencyLimiter, wrap_with_cache
 
 
-def query_llm(text: str, question: str, config: dict) -> str:
-    """Query LLM via Ollama API."""
-    prompt = f"""You are a helpful assistant. Answer the question using ONLY the provided Context. If the answer is in the context, output it directly.
+PROMPT_TEMPLATE = """You are a helpful assistant. Answer the question using ONLY the provided Context. If the answer is in the context, output it directly.
 
 Context:
-{text}
+{context}
 
 Question: {question}
 
 Answer:"""
 
-    try:
-        response = requests.post(
-            config['model']['url'],
-            json={
-                "model": config['model']['name'],
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": config['model']['temperature'],
-                    "num_predict": config['model']['max_tokens']
-                }
-            },
-            timeout=60
-        )
-        return response.json().get('response', '').strip()
-    except Exception as e:
-        return f"ERROR: {str(e)}"
-
 
 def evaluate(response: str, expected: str) -> int:
     """Check if expected answer is in response."""
@@ -57,7 +38,8 @@ def run_experiment():
         log_dir=Path(config['logging']['log_dir']),
         level=config['logging']['level'],
         console=config['logging']['console'],
-        file=config['logging']['file']
+        file=config['logging']['file'],
+        queue=config['logging'].get('queue', False)
     )
 
     set_seed(config['experiment']['seed'])
@@ -67,54 +49,99 @@ def run_experiment():
     logger.info("=" * 60)
     logger.info(f"Hypothesis: Facts at edges (start/end) are retrieved better than middle")
 
+    llm = wrap_with_cache(OllamaLLM(
+        model_name=config['model']['name'],
+        base_url=config['model']['url'],
+        temperature=config['model']['temperature'],
+        max_tokens=config['model']['max_tokens'],
+        timeout=config['model'].get('timeout', 60),
+        max_concurrency=config['model'].get('max_concurrency', 1),
+        seed=config['model'].get('seed'),
+        prompt_template=PROMPT_TEMPLATE,
+        keep_alive=config['model'].get('keep_alive'),
+        format=config['model'].get('format'),
+        early_stop=config['model'].get('early_stop', False),
+        stop=config['model'].get('stop'),
+        limiter=AdaptiveConcurrencyLimiter.from_config(config['model'].get('adaptive_concurrency'))
+    ), config.get('cache'))
+
+    # Load the model up front so the first test case doesn't pay for it
+    warmup = llm.warmup() if config['model'].get('warmup', False) else {}
+    if warmup:
+        logger.info(f"Model warm-up: load {warmup['load_time']:.2f}s (excluded from measurements)")
+
     # Prepare results storage
     results = {
         'documents': [],
-        'scores': {'start': [], 'middle': [], 'end': []}
+        'scores': {'start': [], 'middle': [], 'end': []},
+        'warmup': warmup
     }
 
     # Run test cases
     test_cases = config['dataset']['test_cases']
 
-    for i, (position, pct) in enumerate(test_cases, 1):
-        logger.info(f"\n[{i}/{len(test_cases)}] Testing {position.upper()} position ({pct*100:.0f}%)")
-
-        # Generate document with needle at specified position
-        filler_text = generate_text_block(
-            domain="generic",
-            min_words=config['dataset']['doc_length']
-        )
+    # The k-th case of every position shares the k-th filler text, so
+    # positions are compared over identical filler. Each filler draws from
+    # its own seeded stream and is tokenized once; the needle is inserted
+    # per position without copying it (rendered only when queried)
+    repetitions = []
+    seen: Dict[str, int] = {}
+    for position, _ in test_cases:
+        repetitions.append(seen.get(position, 0))
+        seen[position] = repetitions[-1] + 1
+    rngs = spawn_rngs(config['experiment']['seed'], max(seen.values(), default=0))
+    base_documents = [
+        TextDocument(generate_text_block(domain="generic", min_words=config['dataset']['doc_length'], rng=rng))
+        for rng in rngs
+    ]
+    documents = []
+    for i, ((position, pct), rep) in enumerate(zip(test_cases, repetitions), 1):
+        logger.info("\n[%d/%d] Preparing %s position (%.0f%%)", i, len(test_cases), position.upper(), pct * 100)
 
         # Insert the critical fact at the specified position
-        document_text = insert_needle(
-            text=filler_text,
-            needle=config['dataset']['critical_fact'],
-            position=pct
+        document = base_documents[rep].with_needle(config['dataset']['critical_fact'], position=pct)
+        logger.info("  Generated: %d words", document.word_count)
+        documents.append(document)
+
+    # Each finished test case is appended to a JSONL log right away; with
+    # output.resume a restarted run skips the ones already recorded
+    sink = ResultsSink(Path(config['output']['results_dir']), config, resume=config['output'].get('resume', False))
+    pending = [i for i in range(len(documents)) if i not in sink]
+    if len(pending) < len(documents):
+        logger.info(f"\nResuming: {len(documents) - len(pending)} test cases already recorded in {sink.path}")
+
+    def run_case(i: int) -> Dict[str, Any]:
+        result = llm.query(
+            context=documents[i].text,
+            question=config['dataset']['query'],
+            expected_answer=config['dataset']['expected_answer']
         )
+        sink.write(i, result)
+        return result
 
-        word_count = len(document_text.split())
-        logger.info(f"  Generated: {word_count} words")
+    # Query LLM (fan out up to max_concurrency requests at a time)
+    logger.info(f"\nQuerying LLM for {len(pending)} test cases (max_concurrency={llm.max_concurrency})")
+    with sink:
+        run_concurrently([partial(run_case, i) for i in pending], max_concurrency=llm.max_concurrency)
+    llm_results = [sink.get(i) for i in range(len(documents))]
 
-        # Query LLM
-        response = query_llm(
-            text=document_text,
-            question=config['dataset']['query'],
-            config=config
-        )
-        logger.info(f"  Response: '{response}'")
+    for i, ((position, pct), document, llm_result) in enumerate(zip(test_cases, documents, llm_results), 1):
+        response = llm_result['response']
+        logger.info("\n[%d/%d] %s position (%.0f%%)", i, len(test_cases), position.upper(), pct * 100)
+        logger.info("  Response: '%s'", response)
 
         # Evaluate
         score = evaluate(response, config['dataset']['expected_answer'])
         results['scores'][position].append(score)
 
         result_str = "✓ PASS" if score else "✗ FAIL"
-        logger.info(f"  Result: {result_str}")
+        logger.info("  Result: %s", result_str)
 
         results['documents'].append({
             'id': i,
             'position': position,
             'position_pct': pct * 100,
-            'word_count': word_count,
+            'word_count': document.word_count,
             'response': response,
             'score': score
         })
@@ -148,8 +175,28 @@ def run_experiment():
     else:
         logger.info("\n✗ Hypothesis NOT confirmed")
 
+    conn_stats = llm.connection_stats()
+    logger.info(f"\nHTTP connections: {conn_stats['new_connections']} new, "
+                f"{conn_stats['reused_connections']} reused ({conn_stats['requests']} requests)")
+
     # Save results
     results['statistics'] = stats
+    results['connection_stats'] = conn_stats
+    if llm.limiter is not None:
+        results['limiter_stats'] = llm.limiter.stats()
+        logger.info(f"Adaptive concurrency: final limit {llm.limiter.limit} "
+                    f"({llm.limiter.increases} increases, {llm.limiter.decreases} decreases)")
+    results['prefill_tokens_saved'] = sum(r.get('prefill_tokens_saved', 0) for r in llm_results)
+    logger.info(f"Prefill tokens saved by prefix KV reuse: {results['prefill_tokens_saved']}")
+    results['decode_tokens_saved'] = sum(r.get('decode_tokens_saved', 0) for r in llm_results)
+    if config['model'].get('early_stop', False):
+        logger.info(f"Decode tokens saved by early stop: {results['decode_tokens_saved']}")
+    if hasattr(llm, 'cache'):
+        results['cache_stats'] = llm.cache.stats()
+        logger.info(f"Response cache: {results['cache_stats']['hits']} hits, {results['cache_stats']['misses']} misses")
+    if hasattr(llm, 'semantic_cache'):
+        results['semantic_cache_stats'] = llm.semantic_cache.stats()
+        logger.info(f"Semantic cache: hit rate {results['semantic_cache_stats']['hit_rate']:.1%}")
     results['config'] = config
 
     output_file = save_json_results(results, Path(config['output']['results_dir']))
@@ -2,13 +2,23 @@
 
 import sys
 import time
+import logging
+from functools import partial
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Iterator
 
 # Add root to path to allow importing common
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
-from common import setup_logger, set_seed, load_yaml_config, save_json_results, OllamaLLM, generate_text_block, insert_needle
+from common import setup_logger, set_seed, spawn_rngs, load_yaml_config, save_json_results, ResultsSink, OllamaLLM, MockLLM, generate_text_blocks, insert_needle, DatasetCache, DATA_VERSION, wrap_with_cache, count_tokens, SERVER_TIMING_KEYS
+
+def build_context(count: int, words_per_doc: int, needle: str, rng) -> Iterator[Dict[str, str]]:
+    """Generate the haystack for one scaling level (a single-record corpus)."""
+    blocks = generate_text_blocks(count, words_per_doc, domain="generic", rng=rng)
+    full_text = "".join(block + "\n\n" for block in blocks)
+    
+    # Insert Needle randomly
+    yield {"text": insert_needle(full_text, f"The secret code is {needle}.", position="random", rng=rng)}
 
 def run_experiment():
     # Load Config
@@ -21,7 +31,8 @@ def run_experiment():
         log_dir=Path(config['logging']['log_dir']),
         level=config['logging']['level'],
         console=config['logging']['console'],
-        file=config['logging']['file']
+        file=config['logging']['file'],
+        queue=config['logging'].get('queue', False)
     )
     
     set_seed(config['experiment']['seed'])
@@ -29,46 +40,106 @@ def run_experiment():
     logger.info("Starting Experiment 2: Context Window Size Impact")
     logger.info(f"Testing Doc Counts: {config['dataset']['doc_counts']}")
     
-    # Initialize Model
-    model = OllamaLLM(
-        model_name=config['model']['name'],
-        base_url=config['model']['url'],
-        temperature=config['model']['temperature'],
-        max_tokens=config['model']['max_tokens'],
-        timeout=config['model']['timeout']
-    )
+    # Initialize Model ('mock' backend simulates latency on a virtual clock)
+    if config['model'].get('backend', 'ollama') == 'mock':
+        base_model = MockLLM.from_config(config['model'].get('mock'))
+    else:
+        base_model = OllamaLLM(
+            model_name=config['model']['name'],
+            base_url=config['model']['url'],
+            temperature=config['model']['temperature'],
+            max_tokens=config['model']['max_tokens'],
+            timeout=config['model']['timeout'],
+            stream=config['model'].get('stream', False),
+            keep_alive=config['model'].get('keep_alive'),
+            format=config['model'].get('format'),
+            early_stop=config['model'].get('early_stop', False),
+            stop=config['model'].get('stop')
+        )
+    model = wrap_with_cache(base_model, config.get('cache'))
+    
+    # Load the model up front so the smallest doc_count doesn't pay for it
+    warmup = model.warmup() if config['model'].get('warmup', False) else {}
+    if warmup:
+        logger.info(f"Model warm-up: load {warmup['load_time']:.2f}s (excluded from measurements)")
     
     results = []
     
+    # One independent stream per scaling level, so each level's data is
+    # reproducible on its own
+    doc_counts = config['dataset']['doc_counts']
+    rngs = spawn_rngs(config['experiment']['seed'], len(doc_counts))
+    
+    # Reuse haystacks generated by earlier runs with the same parameters
+    cache_config = config['dataset'].get('cache') or {}
+    dataset_cache = DatasetCache(cache_config.get('dir', ".cache/datasets")) if cache_config.get('enabled', False) else None
+    
+    # Each finished level is appended to a JSONL log right away; with
+    # output.resume a restarted sweep skips the levels already recorded
+    sink = ResultsSink(Path(config['output']['results_dir']), config, resume=config['output'].get('resume', False))
+    
     # Iterate through scaling levels
-    for count in config['dataset']['doc_counts']:
-        logger.info(f"\n--- Testing with {count} Documents ---")
+    with sink:
+        for i, (count, rng) in enumerate(zip(doc_counts, rngs)):
+            logger.info("\n--- Testing with %d Documents ---", count)
+            if count in sink:
+                logger.info("Already recorded in %s, skipping", sink.path)
+                results.append(sink.get(count))
+                continue
         
-        # 1. Generate Data
-        full_text = ""
-        for _ in range(count):
-            full_text += generate_text_block(domain="generic", min_words=config['dataset']['words_per_doc']) + "\n\n"
-            
-        # Insert Needle randomly
-        full_text = insert_needle(full_text, f"The secret code is {config['dataset']['needle']}.", position="random")
+            # 1. Generate Data
+            generate = partial(build_context, count, config['dataset']['words_per_doc'], config['dataset']['needle'], rng)
+            if dataset_cache is not None:
+                params = {"doc_count": count, "words_per_doc": config['dataset']['words_per_doc'], "needle": config['dataset']['needle']}
+                with dataset_cache.get_or_create(params, config['experiment']['seed'], DATA_VERSION, generate, stream=i) as corpus:
+                    full_text = corpus[0]["text"]
+            else:
+                full_text = next(generate())["text"]
         
-        # 2. Query Model
-        logger.info(f"Context Length: ~{len(full_text.split())} words")
-        result = model.query(
-            context=full_text,
-            question=config['dataset']['query'],
-            expected_answer=config['dataset']['needle']
-        )
+            # 2. Query Model
+            if logger.isEnabledFor(logging.INFO):
+                # Tokenizing the whole context is not free; skip it when the line is dropped
+                logger.info("Context Length: ~%d tokens", count_tokens(full_text))
+            result = model.query(
+                context=full_text,
+                question=config['dataset']['query'],
+                expected_answer=config['dataset']['needle']
+            )
         
-        logger.info(f"Result: Latency={result['latency']:.4f}s | Accurate={result['is_accurate']}")
+            logger.info("Result: Latency=%.4fs | Accurate=%s", result['latency'], result['is_accurate'])
         
-        # 3. Store
-        results.append({
-            "doc_count": count,
-            "estimated_tokens": result['token_count'],
-            "latency": result['latency'],
-            "accuracy": 1 if result['is_accurate'] else 0
-        })
+            # 3. Store
+            record = {
+                "doc_count": count,
+                "estimated_tokens": result['token_count'],
+                "latency": result['latency'],
+                "accuracy": 1 if result['is_accurate'] else 0
+            }
+            if result.get('error'):
+                # Not counted as done when resuming, so the level is retried
+                record["error"] = result['error']
+            if 'ttft' in result:
+                # Streaming splits latency into prefill (TTFT) and decode rate
+                logger.info("        TTFT=%.4fs | Decode=%.1f tok/s", result['ttft'], result['tokens_per_second'])
+                record.update({
+                    "ttft": result['ttft'],
+                    "inter_token_latency": result['inter_token_latency'],
+                    "tokens_per_second": result['tokens_per_second'],
+                    "output_tokens": result['output_tokens']
+                })
+            if 'stopped_early' in result:
+                record.update({
+                    "stopped_early": result['stopped_early'],
+                    "decode_tokens_saved": result['decode_tokens_saved']
+                })
+            if 'total_duration' in result:
+                # Attribute latency to model load / prefill / decode / client+network
+                logger.info("        Load=%.4fs | Prefill=%.4fs | Decode=%.4fs | Overhead=%.4fs",
+                            result['load_duration'], result['prompt_eval_duration'],
+                            result['eval_duration'], result['client_overhead'])
+                record.update({key: result[key] for key in SERVER_TIMING_KEYS})
+            results.append(record)
+            sink.write(count, record)
         
     # Final Report
     logger.info("\n=== FINAL REPORT ===")
@@ -76,7 +147,22 @@ def run_experiment():
     for r in results:
         logger.info(f"{r['doc_count']:<6} | {r['estimated_tokens']:<10} | {r['latency']:<10.4f} | {r['accuracy']:<10}")
         
-    save_json_results(results, Path(config['output']['results_dir']))
+    if getattr(base_model, 'clock', None) is not None:
+        logger.info(f"Simulated time: {base_model.clock.now:.2f}s (virtual clock)")
+    if any('decode_tokens_saved' in r for r in results):
+        logger.info(f"Decode tokens saved by early stop: {sum(r.get('decode_tokens_saved', 0) for r in results)}")
+    if hasattr(model, 'semantic_cache'):
+        logger.info(f"Semantic cache: hit rate {model.semantic_cache.stats()['hit_rate']:.1%}")
+    if dataset_cache is not None:
+        logger.info(f"Dataset cache: {dataset_cache.hits} hits, {dataset_cache.misses} generated")
+    conn_stats = model.connection_stats()
+    logger.info(f"HTTP connections: {conn_stats['new_connections']} new, {conn_stats['reused_connections']} reused")
+        
+    save_json_results(
+        {'config': config, 'warmup': warmup, 'results': results},
+        Path(config['output']['results_dir']),
+        config=config
+    )
     logger.info(f"Results saved to {config['output']['results_dir']}")
 
 if __name__ == "__main__":
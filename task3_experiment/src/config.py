@@ -2,7 +2,7 @@
 
 import yaml
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Union
 from dataclasses import dataclass
 
 @dataclass
@@ -25,6 +25,9 @@ class DatasetConfig:
     target_domain: str
     distractor_domains: List[str]
     needle: NeedleConfig
+    storage: str = "memory"
+    storage_dir: str = "task3_experiment/data"
+    cache: Optional[Dict[str, Any]] = None
 
 @dataclass
 class RAGConfig:
@@ -35,11 +38,30 @@ class RAGConfig:
 
 @dataclass
 class ModelConfig:
-    url: str
+    url: Union[str, List[str]]
     name: str
     temperature: float
     max_tokens: int
     timeout: int
+    max_concurrency: int = 1
+    keep_alive: Optional[str] = None
+    warmup: bool = False
+    format: Optional[Union[str, Dict[str, Any]]] = None
+    early_stop: bool = False
+    stop: Optional[List[str]] = None
+    adaptive_concurrency: Optional[Dict[str, Any]] = None
+    hedge_percentile: Optional[float] = None
+    hedge_min_samples: int = 20
+    backend: str = "ollama"
+    mock: Optional[Dict[str, Any]] = None
+
+@dataclass
+class CacheConfig:
+    enabled: bool = False
+    path: str = ".cache/llm_responses.sqlite"
+    max_mb: int = 512
+    bypass: bool = False
+    semantic: Optional[Dict[str, Any]] = None
 
 @dataclass
 class LoggingConfig:
@@ -47,11 +69,13 @@ class LoggingConfig:
     console: bool
     file: bool
     log_dir: str
+    queue: bool = False
 
 @dataclass
 class OutputConfig:
     results_dir: str
     save_details: bool
+    resume: bool = False
 
 @dataclass
 class Config:
@@ -61,6 +85,7 @@ class Config:
     model: ModelConfig
     logging: LoggingConfig
     output: OutputConfig
+    cache: CacheConfig
 
 def load_config(config_path: Optional[Path] = None) -> Config:
     if config_path is None:
@@ -81,5 +106,6 @@ def load_config(config_path: Optional[Path] = None) -> Config:
         rag=RAGConfig(**config_dict['rag']),
         model=ModelConfig(**config_dict['model']),
         logging=LoggingConfig(**config_dict['logging']),
-        output=OutputConfig(**config_dict['output'])
+        output=OutputConfig(**config_dict['output']),
+        cache=CacheConfig(**config_dict.get('cache', {}))
     )
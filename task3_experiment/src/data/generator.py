@@ -1,9 +1,14 @@
 """Data generation for RAG experiment (Hebrew)."""
 
 import random
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Iterator
 from dataclasses import dataclass
 
+from common import TextDocument
+
+# Bump when a change alters the documents generated for a given seed (invalidates DatasetCache entries)
+GENERATOR_VERSION = 1
+
 @dataclass
 class Document:
     id: int
@@ -52,71 +57,69 @@ TEMPLATES = {
     ]
 }
 
-def generate_filler_text(domain: str, min_words: int) -> str:
+def generate_filler_text(domain: str, min_words: int, rng: Optional[random.Random] = None) -> str:
     """Generate random filler text for a specific domain."""
+    rng = rng or random
     templates = TEMPLATES.get(domain, TEMPLATES["technology"])
     text_parts = []
     current_words = 0
     
     while current_words < min_words:
-        sentence = random.choice(templates)
+        sentence = rng.choice(templates)
         text_parts.append(sentence)
         current_words += len(sentence.split())
         
     return " ".join(text_parts)
 
-def generate_dataset(config) -> List[Document]:
+def iter_documents(config, rng: Optional[random.Random] = None) -> Iterator[Document]:
     """
-    Generate a dataset of documents.
+    Lazily generate the documents of a dataset, one at a time.
+    
+    Nothing is retained between documents, so corpora of any size can be
+    streamed to disk (see ``common.write_corpus``) or straight into an
+    indexer with flat memory use.
     
     Args:
         config: DatasetConfig object
+        rng: Random stream (e.g. from spawn_rngs); defaults to the global random
         
-    Returns:
-        List of Document objects
+    Yields:
+        Document objects in id order
     """
-    documents = []
-    
-    # Create list of domains for all docs
-    # 1 Target (Medicine), Rest Distractors
-    domains = [config.target_domain] 
-    
-    # Fill the rest with distractors
-    num_distractors = config.total_docs - 1
-    for _ in range(num_distractors):
-        domains.append(random.choice(config.distractor_domains))
-        
-    # Shuffle to randomize where the target domain appears (optional, but we force needle index)
-    # However, the config says `needle.doc_index` is fixed. So let's respect that.
-    # We will force the document at `doc_index` to be the target domain.
-    
-    # Re-build domains list to guarantee target at index
-    final_domains = [random.choice(config.distractor_domains) for _ in range(config.total_docs)]
-    final_domains[config.needle.doc_index] = config.target_domain
+    rng = rng or random
     
     for i in range(config.total_docs):
-        domain = final_domains[i]
+        # 1 Target (Medicine) document at the fixed needle index, the rest distractors
         is_needle_doc = (i == config.needle.doc_index)
+        domain = config.target_domain if is_needle_doc else rng.choice(config.distractor_domains)
         
         # Generate base text
-        text = generate_filler_text(domain, config.doc_length_words)
+        text = generate_filler_text(domain, config.doc_length_words, rng)
         
         # Insert needle if it's the target doc
         needle_fact = ""
         if is_needle_doc:
             needle_fact = config.needle.fact
             # Insert somewhere in the middle to make it "searchable"
-            words = text.split()
-            insert_pos = len(words) // 2
-            words.insert(insert_pos, needle_fact)
-            text = " ".join(words)
+            text = TextDocument(text).with_needle(needle_fact, 0.5).text
             
-        documents.append(Document(
+        yield Document(
             id=i,
             domain=domain,
             text=text,
             has_needle=is_needle_doc,
             needle_fact=needle_fact
-        ))
+        )
+
+def generate_dataset(config, rng: Optional[random.Random] = None) -> List[Document]:
+    """
+    Generate a dataset of documents.
+    
+    Args:
+        config: DatasetConfig object
+        rng: Random stream (e.g. from spawn_rngs); defaults to the global random
         
-    return documents
+    Returns:
+        List of Document objects
+    """
+    return list(iter_documents(config, rng))
@@ -2,9 +2,14 @@
 
 from typing import List, Dict, Any
 
+from common import SERVER_TIMING_KEYS
+
 def calculate_statistics(results: List[Dict[str, Any]]) -> Dict[str, float]:
     """
     Calculate average latency and accuracy.
+    
+    When the backend reports server timing, also averages the latency
+    breakdown (model load, prefill, decode, client/network overhead).
     """
     if not results:
         return {
@@ -17,8 +22,17 @@ def calculate_statistics(results: List[Dict[str, Any]]) -> Dict[str, float]:
     total_correct = sum(1 for r in results if r['is_accurate'])
     count = len(results)
     
-    return {
+    stats = {
         "avg_latency": total_latency / count,
         "accuracy": (total_correct / count) * 100.0,
         "count": count
     }
+    
+    if any('decode_tokens_saved' in r for r in results):
+        stats["decode_tokens_saved"] = sum(r.get('decode_tokens_saved', 0) for r in results)
+    
+    timed = [r for r in results if 'total_duration' in r]
+    if timed:
+        for key in SERVER_TIMING_KEYS:
+            stats[f"avg_{key}"] = sum(r[key] for r in timed) / len(timed)
+    return stats
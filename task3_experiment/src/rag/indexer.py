@@ -2,10 +2,13 @@
 
 import numpy as np
 import faiss
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable
 from dataclasses import dataclass
 from sentence_transformers import SentenceTransformer
 
+# Multilingual, for Hebrew support
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
 @dataclass
 class Chunk:
     id: str
@@ -18,7 +21,8 @@ class VectorStore:
     """Production-grade FAISS-based vector store with dense embeddings."""
     
     def __init__(self, chunk_size: int = 500, overlap: int = 50, 
-                 embedding_model: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"):
+                 embedding_model: str = DEFAULT_EMBEDDING_MODEL,
+                 encoder: Optional[SentenceTransformer] = None):
         """
         Initialize FAISS vector store.
         
@@ -26,56 +30,53 @@ class VectorStore:
             chunk_size: Number of words per chunk
             overlap: Number of overlapping words between chunks
             embedding_model: SentenceTransformer model name (multilingual for Hebrew support)
+            encoder: Already-loaded SentenceTransformer to share; embedding_model is loaded if None
         """
         self.chunk_size = chunk_size
         self.overlap = overlap
         self.chunks: List[Chunk] = []
         
         # Load embedding model (multilingual for Hebrew support)
-        print(f"Loading embedding model: {embedding_model}")
-        self.encoder = SentenceTransformer(embedding_model)
+        if encoder is None:
+            print(f"Loading embedding model: {embedding_model}")
+            encoder = SentenceTransformer(embedding_model)
+        self.encoder = encoder
         self.embedding_dim = self.encoder.get_sentence_embedding_dimension()
         
         # FAISS index (L2 distance, can switch to cosine similarity)
         self.index: Optional[faiss.IndexFlatL2] = None
         self.total_chunks = 0
         
-    def add_documents(self, documents: List[Any]):
-        """Chunk documents, generate embeddings, and index with FAISS."""
+    def add_documents(self, documents: Iterable[Any], batch_size: int = 1024):
+        """
+        Chunk documents, generate embeddings, and index with FAISS.
+        
+        Documents are consumed lazily, so a generator or CorpusStore can be
+        passed without materializing the corpus. Chunks are embedded and
+        added to the index in batches of ``batch_size``, so only one batch of
+        embeddings is held in memory at a time.
+        """
         self.chunks = []
-        chunk_counter = 0
+        self.index = faiss.IndexFlatL2(self.embedding_dim)
+        pending: List[Chunk] = []
         
-        # 1. Create chunks
-        print("Chunking documents...")
+        print("Chunking and embedding documents...")
         for doc in documents:
-            doc_chunks = self._create_chunks(doc)
-            for chunk_text in doc_chunks:
-                chunk = Chunk(
-                    id=f"chunk_{chunk_counter}",
+            for chunk_text in self._create_chunks(doc):
+                pending.append(Chunk(
+                    id=f"chunk_{len(self.chunks) + len(pending)}",
                     doc_id=doc.id,
                     text=chunk_text,
                     metadata={"domain": doc.domain, "has_needle": doc.has_needle}
-                )
-                self.chunks.append(chunk)
-                chunk_counter += 1
+                ))
+                if len(pending) >= batch_size:
+                    self._index_batch(pending)
+                    pending = []
+        if pending:
+            self._index_batch(pending)
                 
         self.total_chunks = len(self.chunks)
-        print(f"Created {self.total_chunks} chunks")
-        
-        # 2. Generate embeddings
-        print("Generating embeddings...")
-        chunk_texts = [chunk.text for chunk in self.chunks]
-        embeddings = self.encoder.encode(chunk_texts, show_progress_bar=True, 
-                                         convert_to_numpy=True, batch_size=32)
-        
-        # Store embeddings in chunks
-        for i, chunk in enumerate(self.chunks):
-            chunk.embedding = embeddings[i]
-        
-        # 3. Build FAISS index
-        print("Building FAISS index...")
-        self._build_faiss_index(embeddings)
-        print("Indexing complete!")
+        print(f"Indexed {self.total_chunks} chunks")
         
     def _create_chunks(self, doc: Any) -> List[str]:
         """Split document text into overlapping chunks."""
@@ -92,17 +93,17 @@ class VectorStore:
             
         return chunks
         
-    def _build_faiss_index(self, embeddings: np.ndarray):
-        """Build FAISS index for efficient similarity search."""
-        # Use L2 distance (Euclidean)
-        # For cosine similarity, normalize embeddings first
-        self.index = faiss.IndexFlatL2(self.embedding_dim)
+    def _index_batch(self, chunks: List[Chunk]):
+        """Embed a batch of chunks and add them to the FAISS index."""
+        embeddings = self.encoder.encode([chunk.text for chunk in chunks],
+                                         convert_to_numpy=True, batch_size=32)
+        embeddings = embeddings.astype('float32')
         
         # Normalize for cosine similarity
         faiss.normalize_L2(embeddings)
         
-        # Add vectors to index
-        self.index.add(embeddings.astype('float32'))
+        self.index.add(embeddings)
+        self.chunks.extend(chunks)
         
     def similarity_search(self, query: str, k: int = 3) -> List[Chunk]:
         """
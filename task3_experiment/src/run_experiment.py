@@ -3,25 +3,30 @@
 import sys
 import json
 import time
+import logging
+from functools import partial
+from dataclasses import asdict
 from pathlib import Path
-from typing import Dict, Any, List, TYPE_CHECKING
+from typing import Dict, Any, List, Iterable, Optional, TYPE_CHECKING
 
 # Add root to path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
-from common import setup_logger, set_seed, save_json_results, OllamaLLM
+from common import setup_logger, set_seed, spawn_rngs, save_json_results, ResultsSink, write_corpus, CorpusStore, DatasetCache, OllamaLLM, MockLLM, AdaptiveConcurrencyLimiter, run_concurrently, wrap_with_cache, count_tokens
 from task3_experiment.src.config import load_config, Config
-from task3_experiment.src.data.generator import generate_dataset
-from task3_experiment.src.rag.indexer import VectorStore
+from task3_experiment.src.data.generator import Document, GENERATOR_VERSION, generate_dataset, iter_documents
+from task3_experiment.src.rag.indexer import VectorStore, DEFAULT_EMBEDDING_MODEL, SentenceTransformer
 from task3_experiment.src.evaluation.metrics import calculate_statistics
 
 def run_mode_a_full_context(config: Config, documents: List[Any], llm: OllamaLLM, logger) -> Dict[str, Any]:
     """Execute Mode A: Full Context."""
     logger.info("--- [Mode A] Starting Full Context Execution ---")
     
-    # Concatenate ALL documents
-    full_context = "\n\n".join([d.text for d in documents])
-    logger.info(f"Full Context Size: {len(full_context.split())} words")
+    # Concatenate ALL documents (streamed, so no intermediate list of texts)
+    full_context = "\n\n".join(d.text for d in documents)
+    if logger.isEnabledFor(logging.INFO):
+        # Tokenizing the whole context is not free; skip it when the line is dropped
+        logger.info("Full Context Size: ~%d tokens", count_tokens(full_context))
     
     # Query LLM
     result = llm.query(
@@ -30,10 +35,12 @@ def run_mode_a_full_context(config: Config, documents: List[Any], llm: OllamaLLM
         expected_answer=config.dataset.needle.fact
     )
     
-    logger.info(f"Mode A Result: Latency={result['latency']:.4f}s | Accurate={result['is_accurate']}")
+    logger.info("Mode A Result: Latency=%.4fs | Accurate=%s | Prefill tokens saved=%s",
+                result['latency'], result['is_accurate'], result.get('prefill_tokens_saved', 0))
     return result
 
-def run_mode_b_rag(config: Config, documents: List[Any], llm: OllamaLLM, logger) -> Dict[str, Any]:
+def run_mode_b_rag(config: Config, documents: List[Any], llm: OllamaLLM, logger,
+                   encoder: Optional[SentenceTransformer] = None) -> Dict[str, Any]:
     """Execute Mode B: RAG."""
     logger.info("--- [Mode B] Starting RAG Execution ---")
     
@@ -42,14 +49,15 @@ def run_mode_b_rag(config: Config, documents: List[Any], llm: OllamaLLM, logger)
     start_index = time.perf_counter()
     vector_store = VectorStore(
         chunk_size=config.rag.chunk_size,
-        overlap=config.rag.chunk_overlap
+        overlap=config.rag.chunk_overlap,
+        encoder=encoder
     )
     vector_store.add_documents(documents)
     index_time = time.perf_counter() - start_index
     logger.info(f"Indexing complete in {index_time:.4f}s. Total chunks: {vector_store.total_chunks}")
     
     # 2. Retrieval
-    logger.info(f"Retrieving Top-{config.rag.top_k} chunks...")
+    logger.info("Retrieving Top-%d chunks...", config.rag.top_k)
     retrieval_start = time.perf_counter()
     relevant_chunks = vector_store.similarity_search(
         query=config.dataset.needle.query,
@@ -59,9 +67,9 @@ def run_mode_b_rag(config: Config, documents: List[Any], llm: OllamaLLM, logger)
     
     # Log retrieved chunks
     for i, chunk in enumerate(relevant_chunks):
-        logger.debug(f"Chunk {i+1} (Doc {chunk.doc_id}): {chunk.text[:50]}...")
+        logger.debug("Chunk %d (Doc %s): %.50s...", i + 1, chunk.doc_id, chunk.text)
         if chunk.metadata['has_needle']:
-            logger.info(f"✓ Retrieved chunk containing needle (Doc {chunk.doc_id})")
+            logger.info("✓ Retrieved chunk containing needle (Doc %s)", chunk.doc_id)
 
     # 3. Context Construction
     rag_context = "\n\n".join([c.text for c in relevant_chunks])
@@ -79,9 +87,53 @@ def run_mode_b_rag(config: Config, documents: List[Any], llm: OllamaLLM, logger)
     result['retrieval_time'] = retrieval_time
     result['generation_time'] = result['latency'] - retrieval_time
     
-    logger.info(f"Mode B Result: Total Latency={result['latency']:.4f}s (Retrieval={retrieval_time:.4f}s) | Accurate={result['is_accurate']}")
+    logger.info("Mode B Result: Total Latency=%.4fs (Retrieval=%.4fs) | Accurate=%s",
+                result['latency'], retrieval_time, result['is_accurate'])
     return result
 
+def make_dataset_cache(config: Config) -> Optional[DatasetCache]:
+    """Dataset cache from ``dataset.cache``, or None when disabled."""
+    cache_config = config.dataset.cache or {}
+    if not cache_config.get('enabled', False):
+        return None
+    return DatasetCache(cache_config.get('dir', ".cache/datasets"))
+
+def load_dataset(config: Config, i: int, rng, dataset_cache: Optional[DatasetCache], logger) -> Iterable[Any]:
+    """
+    Generate (or open) the dataset for iteration ``i`` from its own seeded stream.
+    
+    Called from inside each iteration, so only the in-flight iterations'
+    data is resident. With ``dataset.storage: disk`` documents are streamed
+    straight to a JSONL corpus and returned as a lazily-read CorpusStore,
+    so memory stays flat regardless of ``total_docs``. With
+    ``dataset.cache`` enabled, a corpus generated by an earlier run with the
+    same parameters is memory-mapped instead of regenerated.
+    """
+    if dataset_cache is not None:
+        params = {k: v for k, v in asdict(config.dataset).items() if k not in ('storage', 'storage_dir', 'cache')}
+        return dataset_cache.get_or_create(
+            params, config.experiment.seed, GENERATOR_VERSION,
+            partial(iter_documents, config.dataset, rng),
+            stream=i, record_type=Document
+        )
+    
+    if config.dataset.storage != "disk":
+        return generate_dataset(config.dataset, rng)
+    
+    store = write_corpus(iter_documents(config.dataset, rng),
+                         Path(config.dataset.storage_dir) / f"iteration_{i}.jsonl", record_type=Document)
+    logger.info(f"Wrote corpus {store.path} ({len(store)} docs, {store.size_bytes / 1e6:.1f} MB)")
+    return store
+
+def log_latency_breakdown(stats: Dict[str, Any], logger):
+    """Log where the average latency went, if the server reported timing."""
+    if 'decode_tokens_saved' in stats:
+        logger.info(f"  Decode tokens saved (early stop): {stats['decode_tokens_saved']}")
+    if 'avg_total_duration' not in stats:
+        return
+    logger.info(f"  Breakdown:   load={stats['avg_load_duration']:.4f}s | prefill={stats['avg_prompt_eval_duration']:.4f}s "
+                f"| decode={stats['avg_eval_duration']:.4f}s | overhead={stats['avg_client_overhead']:.4f}s")
+
 def main():
     # Load Config
     config = load_config()
@@ -92,43 +144,83 @@ def main():
         log_dir=Path(config.logging.log_dir),
         level=config.logging.level,
         console=config.logging.console,
-        file=config.logging.file
+        file=config.logging.file,
+        queue=config.logging.queue
     )
     
     logger.info(f"Initialized Experiment: {config.experiment.name}")
     
-    # Initialize Real LLM
-    llm = OllamaLLM(
-        model_name=config.model.name,
-        base_url=config.model.url,
-        temperature=config.model.temperature,
-        max_tokens=config.model.max_tokens,
-        timeout=config.model.timeout
-    )
+    # Initialize LLM ('mock' backend simulates latency on a virtual clock)
+    if config.model.backend == "mock":
+        base_llm = MockLLM.from_config(config.model.mock)
+        base_llm.max_concurrency = config.model.max_concurrency
+    else:
+        base_llm = OllamaLLM(
+            model_name=config.model.name,
+            base_url=config.model.url,
+            temperature=config.model.temperature,
+            max_tokens=config.model.max_tokens,
+            timeout=config.model.timeout,
+            max_concurrency=config.model.max_concurrency,
+            keep_alive=config.model.keep_alive,
+            format=config.model.format,
+            early_stop=config.model.early_stop,
+            stop=config.model.stop,
+            limiter=AdaptiveConcurrencyLimiter.from_config(config.model.adaptive_concurrency),
+            hedge_percentile=config.model.hedge_percentile,
+            hedge_min_samples=config.model.hedge_min_samples
+        )
+    # One embedding model, shared by every iteration's vector store and the semantic cache
+    encoder = SentenceTransformer(DEFAULT_EMBEDDING_MODEL)
+    llm = wrap_with_cache(base_llm, vars(config.cache), encoder=encoder)
     
-    logger.info(f"Using model: {config.model.name} at {config.model.url}")
+    # Load the model up front so the first iteration doesn't pay for it
+    warmup = llm.warmup() if config.model.warmup else {}
+    if warmup:
+        logger.info(f"Model warm-up: load {warmup['load_time']:.2f}s (excluded from measurements)")
     
-    # Storage for results
-    results_a = []
-    results_b = []
+    logger.info(f"Using model: {config.model.name} at {config.model.url}")
     
     # Run N iterations to get stable stats
     iterations = 5
-    logger.info(f"Running {iterations} iterations...")
+    logger.info(f"Running {iterations} iterations (max_concurrency={llm.max_concurrency})...")
     
-    for i in range(iterations):
-        logger.info(f"\n=== Iteration {i+1}/{iterations} ===")
-        
-        # Generate Fresh Data
-        documents = generate_dataset(config.dataset)
-        
-        # Run Mode A
-        res_a = run_mode_a_full_context(config, documents, llm, logger)
-        results_a.append(res_a)
-        
-        # Run Mode B
-        res_b = run_mode_b_rag(config, documents, llm, logger)
-        results_b.append(res_b)
+    # Fresh data for every iteration, each from its own seeded stream, so the
+    # datasets are identical regardless of how the iterations are scheduled
+    rngs = spawn_rngs(config.experiment.seed, iterations)
+    dataset_cache = make_dataset_cache(config)
+    
+    def run_iteration(i: int):
+        logger.info("\n=== Iteration %d/%d ===", i + 1, iterations)
+        documents = load_dataset(config, i, rngs[i], dataset_cache, logger)
+        try:
+            # Run Mode A
+            res_a = run_mode_a_full_context(config, documents, llm, logger)
+            
+            # Run Mode B
+            res_b = run_mode_b_rag(config, documents, llm, logger, encoder)
+        finally:
+            if isinstance(documents, CorpusStore):
+                documents.close()
+        sink.write(i, {"a": res_a, "b": res_b})
+        return res_a, res_b
+    
+    # Each finished iteration is appended to a JSONL log right away; with
+    # output.resume a restarted run skips the iterations already recorded
+    sink = ResultsSink(Path(config.output.results_dir), asdict(config), resume=config.output.resume)
+    pending = [i for i in range(iterations) if i not in sink]
+    if len(pending) < iterations:
+        logger.info(f"Resuming: {iterations - len(pending)} iterations already recorded in {sink.path}")
+    
+    with sink:
+        run_concurrently(
+            [partial(run_iteration, i) for i in pending],
+            max_concurrency=llm.max_concurrency
+        )
+    
+    # Storage for results
+    results_a = [sink.get(i)["a"] for i in range(iterations)]
+    results_b = [sink.get(i)["b"] for i in range(iterations)]
         
     # Analyze
     stats_a = calculate_statistics(results_a)
@@ -142,10 +234,12 @@ def main():
     logger.info(f"MODE A (Full Context):")
     logger.info(f"  Avg Latency: {stats_a['avg_latency']:.4f}s")
     logger.info(f"  Accuracy:    {stats_a['accuracy']:.1f}%")
+    log_latency_breakdown(stats_a, logger)
     
     logger.info(f"\nMODE B (RAG):")
     logger.info(f"  Avg Latency: {stats_b['avg_latency']:.4f}s")
     logger.info(f"  Accuracy:    {stats_b['accuracy']:.1f}%")
+    log_latency_breakdown(stats_b, logger)
     
     # Comparison
     latency_reduction = ((stats_a['avg_latency'] - stats_b['avg_latency']) / stats_a['avg_latency']) * 100
@@ -158,6 +252,21 @@ def main():
     else:
         logger.info("Conclusion: Results inconclusive or unexpected.")
 
+    if getattr(base_llm, 'clock', None) is not None:
+        logger.info(f"Simulated LLM time: {base_llm.clock.now:.2f}s (virtual clock)")
+    if llm.limiter is not None:
+        logger.info(f"Adaptive concurrency: final limit {llm.limiter.limit} "
+                    f"({llm.limiter.increases} increases, {llm.limiter.decreases} decreases)")
+    if getattr(base_llm, 'hedge_percentile', None) is not None:
+        hedge_stats = base_llm.hedge_stats()
+        logger.info(f"Hedged requests: {hedge_stats['hedges_issued']} issued, {hedge_stats['hedges_won']} won")
+    if dataset_cache is not None:
+        logger.info(f"Dataset cache: {dataset_cache.hits} hits, {dataset_cache.misses} generated")
+    if hasattr(llm, 'semantic_cache'):
+        logger.info(f"Semantic cache: hit rate {llm.semantic_cache.stats()['hit_rate']:.1%}")
+    conn_stats = llm.connection_stats()
+    logger.info(f"HTTP connections: {conn_stats['new_connections']} new, {conn_stats['reused_connections']} reused")
+
     # Save Results
     save_json_results(
         results={
@@ -165,9 +274,11 @@ def main():
             "stats_a": stats_a,
             "stats_b": stats_b,
             "raw_results_a": results_a,
-            "raw_results_b": results_b
+            "raw_results_b": results_b,
+            "warmup": warmup
         }, 
-        output_dir=Path(config.output.results_dir)
+        output_dir=Path(config.output.results_dir),
+        config=asdict(config)
     )
     logger.info(f"Report saved to {config.output.results_dir}")
 
@@ -1,6 +1,7 @@
 """Multi-step Agent with different memory management strategies."""
 
 import time
+import logging
 from typing import List, Dict, Any, Optional
 from abc import ABC, abstractmethod
 
@@ -36,11 +37,12 @@ class Agent:
     def process_action_sequence(self, actions: List[str]) -> None:
         """Process a sequence of actions step by step."""
         if self.logger:
-            self.logger.info(f"Agent processing {len(actions)} actions with {self.memory.__class__.__name__}")
+            self.logger.info("Agent processing %d actions with %s", len(actions), self.memory.__class__.__name__)
         
+        debug = self.logger is not None and self.logger.isEnabledFor(logging.DEBUG)
         for i, action in enumerate(actions):
-            if self.logger:
-                self.logger.debug(f"Step {i+1}/{len(actions)}: {action}")
+            if debug:
+                self.logger.debug("Step %d/%d: %s", i + 1, len(actions), action)
             
             self.history.append(action)
             self.step_count += 1
@@ -51,7 +53,7 @@ class Agent:
     def answer_question(self, question: str) -> Dict[str, Any]:
         """Answer a question using the memory strategy."""
         if self.logger:
-            self.logger.info(f"Agent answering: '{question}'")
+            self.logger.info("Agent answering: '%s'", question)
         
         result = self.memory.query(question, self.llm, logger=self.logger)
         
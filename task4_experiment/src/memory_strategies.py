@@ -1,23 +1,39 @@
 """Real memory management strategies using LLM."""
 
 import time
+import logging
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from sentence_transformers import SentenceTransformer
+from common import accumulate_server_timing, parse_json_response
 from task4_experiment.src.agent import MemoryStrategy
 
 
+# Structured output for WRITE's per-step extraction
+SCRATCHPAD_SCHEMA = {
+    "type": "object",
+    "properties": {
+        key: {"type": "array", "items": {"type": "string"}}
+        for key in ("inventory", "npcs", "knowledge", "locations")
+    },
+    "required": ["inventory", "npcs", "knowledge", "locations"]
+}
+
+
 class SelectStrategy(MemoryStrategy):
     """SELECT: RAG-based semantic retrieval of relevant history."""
     
-    def __init__(self, top_k: int = 3, embedding_model: str = "all-MiniLM-L6-v2"):
+    def __init__(self, top_k: int = 3, embedding_model: str = "all-MiniLM-L6-v2",
+                 encoder: Optional[SentenceTransformer] = None):
         self.history = []
         self.embeddings = []
         self.top_k = top_k
-        self.encoder = SentenceTransformer(embedding_model)
+        # Reuse an already-loaded encoder when given (loading one per trial is slow)
+        self.encoder = encoder if encoder is not None else SentenceTransformer(embedding_model)
         self.llm_calls = 0
         self.total_latency = 0.0
         self.total_tokens = 0
+        self.server_timing: Dict[str, float] = {}
         
     def process_step(self, step: str, llm, **kwargs) -> None:
         """Store step and compute embedding."""
@@ -27,7 +43,7 @@ class SelectStrategy(MemoryStrategy):
         
         logger = kwargs.get('logger')
         if logger:
-            logger.debug(f"SELECT: Stored step {len(self.history)}")
+            logger.debug("SELECT: Stored step %d", len(self.history))
     
     def query(self, question: str, llm, **kwargs) -> Dict[str, Any]:
         """Retrieve relevant steps and query LLM."""
@@ -50,8 +66,8 @@ class SelectStrategy(MemoryStrategy):
         top_indices = np.argsort(similarities)[-self.top_k:][::-1]
         relevant_steps = [self.history[i] for i in top_indices]
         
-        if logger:
-            logger.info(f"SELECT: Retrieved {len(relevant_steps)} relevant steps (indices: {top_indices.tolist()})")
+        if logger and logger.isEnabledFor(logging.INFO):
+            logger.info("SELECT: Retrieved %d relevant steps (indices: %s)", len(relevant_steps), top_indices.tolist())
         
         # 4. Build context
         context = "Based on the following relevant events:\n" + "\n".join(
@@ -68,6 +84,7 @@ class SelectStrategy(MemoryStrategy):
         self.llm_calls += 1
         self.total_latency = time.time() - start_time
         self.total_tokens += result.get('token_count', 0)
+        accumulate_server_timing(self.server_timing, result)
         
         result['strategy'] = 'SELECT'
         result['retrieved_steps'] = len(relevant_steps)
@@ -81,6 +98,7 @@ class SelectStrategy(MemoryStrategy):
             'llm_calls': self.llm_calls,
             'total_latency': self.total_latency,
             'total_tokens': self.total_tokens,
+            'server_timing': self.server_timing,
             'history_size': len(self.history)
         }
 
@@ -97,6 +115,7 @@ class CompressStrategy(MemoryStrategy):
         self.llm_calls = 0
         self.total_latency = 0.0
         self.total_tokens = 0
+        self.server_timing: Dict[str, float] = {}
         self.compression_count = 0
         
     def process_step(self, step: str, llm, **kwargs) -> None:
@@ -139,10 +158,11 @@ class CompressStrategy(MemoryStrategy):
                 self.llm_calls += 1
                 self.compression_count += 1
                 self.total_tokens += result.get('token_count', 0)
+                accumulate_server_timing(self.server_timing, result)
                 
                 if logger:
-                    logger.info(f"COMPRESS: Compressed {len(to_compress)} steps. Compression #{self.compression_count}")
-                    logger.debug(f"Summary: {new_summary}")
+                    logger.info("COMPRESS: Compressed %d steps. Compression #%d", len(to_compress), self.compression_count)
+                    logger.debug("Summary: %s", new_summary)
         
         self.total_latency += (time.time() - start_time)
     
@@ -164,7 +184,8 @@ class CompressStrategy(MemoryStrategy):
         context = "\n".join(context_parts)
         
         if logger:
-            logger.info(f"COMPRESS: Querying with summary ({len(self.compressed_summary)} chars) + {len(self.recent_history)} recent events")
+            logger.info("COMPRESS: Querying with summary (%d chars) + %d recent events",
+                        len(self.compressed_summary), len(self.recent_history))
         
         # Query LLM
         result = llm.query(
@@ -177,6 +198,7 @@ class CompressStrategy(MemoryStrategy):
         query_time = time.time() - start_time
         self.total_latency += query_time
         self.total_tokens += result.get('token_count', 0)
+        accumulate_server_timing(self.server_timing, result)
         
         result['strategy'] = 'COMPRESS'
         result['compressions_performed'] = self.compression_count
@@ -190,6 +212,7 @@ class CompressStrategy(MemoryStrategy):
             'llm_calls': self.llm_calls,
             'total_latency': self.total_latency,
             'total_tokens': self.total_tokens,
+            'server_timing': self.server_timing,
             'compressions': self.compression_count,
             'summary_length': len(self.compressed_summary),
             'recent_items': len(self.recent_history)
@@ -199,6 +222,9 @@ class CompressStrategy(MemoryStrategy):
 class WriteStrategy(MemoryStrategy):
     """WRITE: Maintain structured scratchpad using LLM extraction."""
     
+    # Labels recognised when the model answers in free text instead of JSON
+    LINE_LABELS = {'inventory:': 'inventory', 'npc:': 'npcs', 'knowledge:': 'knowledge', 'location:': 'locations'}
+    
     def __init__(self):
         self.scratchpad = {
             'inventory': [],
@@ -209,6 +235,8 @@ class WriteStrategy(MemoryStrategy):
         self.llm_calls = 0
         self.total_latency = 0.0
         self.total_tokens = 0
+        self.server_timing: Dict[str, float] = {}
+        self.parse_fallbacks = 0
         
     def process_step(self, step: str, llm, **kwargs) -> None:
         """Use LLM to extract structured information."""
@@ -225,48 +253,56 @@ Locations: {', '.join(self.scratchpad['locations']) if self.scratchpad['location
 
 New event: {step}
 
-Extract any new items, NPCs, knowledge, or locations from this event. Respond with:
-- INVENTORY: [item with description if any]
-- NPC: [name if any]
-- KNOWLEDGE: [fact if any]
-- LOCATION: [place if any]
-Respond "NONE" for categories with no new information."""
+Extract any new items, NPCs, knowledge, or locations from this event.
+Respond with a JSON object with the keys "inventory", "npcs", "knowledge" and "locations",
+each a list of new entries (an empty list for categories with no new information)."""
 
+        # Schema-constrained output keeps the reply short and parseable in one pass
         result = llm.query(
             context=context,
             question="Extract structured information from the event.",
-            expected_answer=""
+            expected_answer="",
+            format=SCRATCHPAD_SCHEMA
         )
         
-        response = result['response'].lower()
-        
-        # Parse response (simple extraction)
-        lines = response.split('\n')
-        for line in lines:
-            line = line.strip()
-            if 'inventory:' in line and 'none' not in line:
-                item = line.split('inventory:', 1)[1].strip()
-                if item and item not in self.scratchpad['inventory']:
-                    self.scratchpad['inventory'].append(item)
-            elif 'npc:' in line and 'none' not in line:
-                npc = line.split('npc:', 1)[1].strip()
-                if npc and npc not in self.scratchpad['npcs']:
-                    self.scratchpad['npcs'].append(npc)
-            elif 'knowledge:' in line and 'none' not in line:
-                knowledge = line.split('knowledge:', 1)[1].strip()
-                if knowledge and knowledge not in self.scratchpad['knowledge']:
-                    self.scratchpad['knowledge'].append(knowledge)
-            elif 'location:' in line and 'none' not in line:
-                location = line.split('location:', 1)[1].strip()
-                if location and location not in self.scratchpad['locations']:
-                    self.scratchpad['locations'].append(location)
+        parsed = result.get('parsed')
+        if parsed is None:
+            parsed = parse_json_response(result['response'])
+        if isinstance(parsed, dict):
+            self._merge_entries(parsed)
+        else:
+            # Backend ignored the schema; fall back to "CATEGORY: value" lines
+            self.parse_fallbacks += 1
+            self._parse_lines(result['response'])
         
         self.llm_calls += 1
         self.total_latency += (time.time() - start_time)
         self.total_tokens += result.get('token_count', 0)
+        accumulate_server_timing(self.server_timing, result)
         
-        if logger:
-            logger.debug(f"WRITE: Processed step. Scratchpad now has {sum(len(v) for v in self.scratchpad.values())} items")
+        if logger and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("WRITE: Processed step. Scratchpad now has %d items", sum(len(v) for v in self.scratchpad.values()))
+    
+    def _add(self, key: str, value: Any):
+        value = str(value).strip().lower()
+        if value and value != 'none' and value not in self.scratchpad[key]:
+            self.scratchpad[key].append(value)
+    
+    def _merge_entries(self, parsed: Dict[str, Any]):
+        """Merge a JSON extraction into the scratchpad."""
+        for key in self.scratchpad:
+            values = parsed.get(key) or []
+            for value in values if isinstance(values, list) else [values]:
+                self._add(key, value)
+    
+    def _parse_lines(self, response: str):
+        """Merge a free-text "INVENTORY: ... / NPC: ..." extraction into the scratchpad."""
+        for line in response.lower().split('\n'):
+            line = line.strip()
+            for label, key in self.LINE_LABELS.items():
+                if label in line and 'none' not in line:
+                    self._add(key, line.split(label, 1)[1])
+                    break
     
     def query(self, question: str, llm, **kwargs) -> Dict[str, Any]:
         """Query using structured scratchpad."""
@@ -281,8 +317,8 @@ Respond "NONE" for categories with no new information."""
         context += f"Knowledge: {', '.join(self.scratchpad['knowledge']) if self.scratchpad['knowledge'] else 'none'}\n"
         context += f"Locations: {', '.join(self.scratchpad['locations']) if self.scratchpad['locations'] else 'none'}\n"
         
-        if logger:
-            logger.info(f"WRITE: Querying with scratchpad ({sum(len(v) for v in self.scratchpad.values())} total items)")
+        if logger and logger.isEnabledFor(logging.INFO):
+            logger.info("WRITE: Querying with scratchpad (%d total items)", sum(len(v) for v in self.scratchpad.values()))
         
         # Query LLM
         result = llm.query(
@@ -295,6 +331,7 @@ Respond "NONE" for categories with no new information."""
         query_time = time.time() - start_time
         self.total_latency += query_time
         self.total_tokens += result.get('token_count', 0)
+        accumulate_server_timing(self.server_timing, result)
         
         result['strategy'] = 'WRITE'
         result['scratchpad_items'] = sum(len(v) for v in self.scratchpad.values())
@@ -308,5 +345,7 @@ Respond "NONE" for categories with no new information."""
             'llm_calls': self.llm_calls,
             'total_latency': self.total_latency,
             'total_tokens': self.total_tokens,
-            'scratchpad_items': sum(len(v) for v in self.scratchpad.values())
+            'server_timing': self.server_timing,
+            'scratchpad_items': sum(len(v) for v in self.scratchpad.values()),
+            'parse_fallbacks': self.parse_fallbacks
         }
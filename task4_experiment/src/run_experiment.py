@@ -3,15 +3,16 @@
 import sys
 import time
 import numpy as np
+from functools import partial
 from pathlib import Path
 from typing import Dict, Any, List
 
 # Add root to path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
-from common import setup_logger, set_seed, load_yaml_config, save_json_results, OllamaLLM
+from common import setup_logger, set_seed, load_yaml_config, save_json_results, ResultsSink, OllamaLLM, AdaptiveConcurrencyLimiter, run_concurrently, wrap_with_cache, SERVER_TIMING_KEYS
 from task4_experiment.src.agent import Agent
-from task4_experiment.src.memory_strategies import SelectStrategy, CompressStrategy, WriteStrategy
+from task4_experiment.src.memory_strategies import SelectStrategy, CompressStrategy, WriteStrategy, SentenceTransformer
 
 
 def generate_action_sequence() -> List[str]:
@@ -91,6 +92,9 @@ def run_single_trial(strategy_name: str, strategy_instance, llm, config: Dict, l
         'context_used': result.get('context_used', ''),
         'additional_metrics': metrics
     }
+    if result.get('error'):
+        # Not counted as done when resuming, so the trial is retried
+        trial_result['error'] = result['error']
     
     # Log summary
     logger.info(f"\n{'-'*60}")
@@ -115,7 +119,8 @@ def run_experiment():
         log_dir=Path(config['logging']['log_dir']),
         level=config['logging']['level'],
         console=config['logging']['console'],
-        file=config['logging']['file']
+        file=config['logging']['file'],
+        queue=config['logging'].get('queue', False)
     )
     
     logger.info("="*70)
@@ -127,18 +132,32 @@ def run_experiment():
     set_seed(config['experiment']['seed'])
     
     # Initialize LLM
+    # One embedding model, shared by every SELECT trial and the semantic cache
+    encoder = SentenceTransformer(config['strategies']['select']['embedding_model'])
+    
     logger.info(f"\nInitializing LLM: {config['model']['name']} at {config['model']['url']}")
-    llm = OllamaLLM(
+    llm = wrap_with_cache(OllamaLLM(
         model_name=config['model']['name'],
         base_url=config['model']['url'],
         temperature=config['model']['temperature'],
         max_tokens=config['model']['max_tokens'],
-        timeout=config['model']['timeout']
-    )
+        timeout=config['model']['timeout'],
+        max_concurrency=config['model'].get('max_concurrency', 1),
+        keep_alive=config['model'].get('keep_alive'),
+        limiter=AdaptiveConcurrencyLimiter.from_config(config['model'].get('adaptive_concurrency')),
+        hedge_percentile=config['model'].get('hedge_percentile'),
+        hedge_min_samples=config['model'].get('hedge_min_samples', 20)
+    ), config.get('cache'), encoder=encoder)
+    
+    # Load the model up front so the first trial doesn't pay for it
+    warmup = llm.warmup() if config['model'].get('warmup', False) else {}
+    if warmup:
+        logger.info(f"Model warm-up: load {warmup['load_time']:.2f}s (excluded from measurements)")
     
     # Storage for all results
     all_results = {
         'config': config,
+        'warmup': warmup,
         'trials': {
             'SELECT': [],
             'COMPRESS': [],
@@ -149,8 +168,8 @@ def run_experiment():
     
     num_trials = config['experiment']['num_trials']
     
-    # Run trials for each strategy
-    for trial_num in range(1, num_trials + 1):
+    def run_trial(trial_num: int) -> Dict[str, Dict[str, Any]]:
+        """Run every strategy once; trials are independent of each other."""
         logger.info(f"\n\n{'#'*70}")
         logger.info(f"# TRIAL {trial_num}/{num_trials}")
         logger.info(f"{'#'*70}\n")
@@ -158,10 +177,10 @@ def run_experiment():
         # SELECT Strategy
         select_strategy = SelectStrategy(
             top_k=config['strategies']['select']['top_k'],
-            embedding_model=config['strategies']['select']['embedding_model']
+            embedding_model=config['strategies']['select']['embedding_model'],
+            encoder=encoder
         )
         select_result = run_single_trial('SELECT', select_strategy, llm, config, logger)
-        all_results['trials']['SELECT'].append(select_result)
         
         # COMPRESS Strategy
         compress_strategy = CompressStrategy(
@@ -169,12 +188,32 @@ def run_experiment():
             max_recent=config['strategies']['compress']['max_recent']
         )
         compress_result = run_single_trial('COMPRESS', compress_strategy, llm, config, logger)
-        all_results['trials']['COMPRESS'].append(compress_result)
         
         # WRITE Strategy
         write_strategy = WriteStrategy()
         write_result = run_single_trial('WRITE', write_strategy, llm, config, logger)
-        all_results['trials']['WRITE'].append(write_result)
+        
+        outcome = {'SELECT': select_result, 'COMPRESS': compress_result, 'WRITE': write_result}
+        sink.write(trial_num, outcome)
+        return outcome
+    
+    # Each finished trial is appended to a JSONL log right away; with
+    # output.resume a restarted run skips the trials already recorded
+    sink = ResultsSink(Path(config['output']['results_dir']), config, resume=config['output'].get('resume', False))
+    pending = [trial_num for trial_num in range(1, num_trials + 1) if trial_num not in sink]
+    if len(pending) < num_trials:
+        logger.info(f"Resuming: {num_trials - len(pending)} trials already recorded in {sink.path}")
+    
+    # Run trials for each strategy (fanned out up to max_concurrency trials at once)
+    with sink:
+        run_concurrently(
+            [partial(run_trial, trial_num) for trial_num in pending],
+            max_concurrency=llm.max_concurrency
+        )
+    for trial_num in range(1, num_trials + 1):
+        outcome = sink.get(trial_num)
+        for strategy_name, trial_result in outcome.items():
+            all_results['trials'][strategy_name].append(trial_result)
     
     # Calculate statistics
     logger.info(f"\n\n{'='*70}")
@@ -216,6 +255,14 @@ def run_experiment():
             }
         }
         
+        # Where the LLM time went (model load / prefill / decode / client+network)
+        timings = [t['additional_metrics'].get('server_timing', {}) for t in trials]
+        if any(timings):
+            stats['server_timing'] = {
+                key: float(np.mean([timing.get(key, 0) for timing in timings]))
+                for key in SERVER_TIMING_KEYS
+            }
+        
         all_results['statistics'][strategy_name] = stats
         
         # Log statistics
@@ -224,6 +271,10 @@ def run_experiment():
         logger.info(f"  Latency: {stats['latency']['mean']:.2f}s ± {stats['latency']['std']:.2f}s")
         logger.info(f"  LLM Calls: {stats['llm_calls']['mean']:.1f} ± {stats['llm_calls']['std']:.1f} (total: {stats['llm_calls']['total']})")
         logger.info(f"  Tokens: {stats['tokens']['mean']:.0f} ± {stats['tokens']['std']:.0f} (total: {stats['tokens']['total']})")
+        if 'server_timing' in stats:
+            timing = stats['server_timing']
+            logger.info(f"  LLM time/trial: load={timing['load_duration']:.2f}s | prefill={timing['prompt_eval_duration']:.2f}s "
+                        f"| decode={timing['eval_duration']:.2f}s | overhead={timing['client_overhead']:.2f}s")
     
     # Final comparative analysis
     logger.info(f"\n{'='*70}")
@@ -262,6 +313,28 @@ def run_experiment():
         logger.info(f"  Accuracy per Second: {accuracy_per_second:.4f}")
         logger.info(f"  Accuracy per Token: {accuracy_per_token:.6f}")
     
+    # Connection pool usage (short SELECT/WRITE prompts benefit most from reuse)
+    conn_stats = llm.connection_stats()
+    all_results['connection_stats'] = conn_stats
+    if llm.limiter is not None:
+        all_results['limiter_stats'] = llm.limiter.stats()
+        logger.info(f"Adaptive concurrency: final limit {llm.limiter.limit} "
+                    f"({llm.limiter.increases} increases, {llm.limiter.decreases} decreases)")
+    if llm.hedge_percentile is not None:
+        all_results['hedge_stats'] = llm.hedge_stats()
+        logger.info(f"Hedged requests: {all_results['hedge_stats']['hedges_issued']} issued, "
+                    f"{all_results['hedge_stats']['hedges_won']} won")
+    all_results['prefill_tokens_saved'] = llm.prefill_tokens_saved
+    logger.info(f"Prefill tokens saved by prefix KV reuse: {llm.prefill_tokens_saved}")
+    if hasattr(llm, 'cache'):
+        all_results['cache_stats'] = llm.cache.stats()
+        logger.info(f"Response cache: {all_results['cache_stats']['hits']} hits, {all_results['cache_stats']['misses']} misses")
+    if hasattr(llm, 'semantic_cache'):
+        all_results['semantic_cache_stats'] = llm.semantic_cache.stats()
+        logger.info(f"Semantic cache: hit rate {all_results['semantic_cache_stats']['hit_rate']:.1%}")
+    logger.info(f"\nHTTP connections: {conn_stats['new_connections']} new, "
+                f"{conn_stats['reused_connections']} reused ({conn_stats['requests']} requests)")
+    
     # Save results
     try:
         output_file = save_json_results(all_results, Path(config['output']['results_dir']))